@@ -0,0 +1,120 @@
+/**
+ * タイムスタンプ付きのパラメータフレームのジッターバッファ。
+ *
+ * Python側はフレームにキャプチャ時刻(t, ms)と連番(seq)を付けて送る。
+ * 受信したフレームを少し遅らせて(playoutDelay)再生し、前後のフレームを
+ * 線形補間することで、トラッキングのFPSやネットワークの揺らぎに関係なく
+ * 表示のフレームレートで滑らかにパラメータを動かす。
+ */
+
+// 補間するパラメータ
+const InterpolatedKeys: string[] = [
+  'roll',
+  'pitch',
+  'yaw',
+  'eyeLOpen',
+  'eyeROpen',
+  'mouthOpen'
+];
+
+// 離散値のパラメータ(補間せずに直前のフレームの値を使う)
+const SteppedKeys: string[] = ['mouthForm', 'eyeBallX', 'eyeBallY'];
+
+export class LAppInterpolator {
+  /**
+   * @param playoutDelay 再生の遅延[ms]、ジッターを吸収できる長さにする
+   * @param maxFrames    保持するフレーム数の上限
+   */
+  constructor(playoutDelay = 100, maxFrames = 32) {
+    this._playoutDelay = playoutDelay;
+    this._maxFrames = maxFrames;
+    this._frames = [];
+    this._offset = null;
+    this._lastSeq = -1;
+    this._lost = 0;
+  }
+
+  /**
+   * 受信したフレームを追加する。
+   *
+   * @param data パラメータ (t, seq 付き)
+   * @param now  受信時刻 (performance.now())
+   */
+  public push(data: any, now: number): void {
+    if (data.t === undefined) {
+      return;
+    }
+
+    // 古いフレーム(順番の入れ替わり)は捨てる
+    const frames = this._frames;
+    if (frames.length > 0 && data.t <= frames[frames.length - 1].t) {
+      return;
+    }
+
+    // 連番の抜けを数える(顔を見失うと連番は0から振り直される)
+    if (data.seq !== undefined) {
+      if (this._lastSeq >= 0 && data.seq > this._lastSeq + 1) {
+        this._lost += data.seq - this._lastSeq - 1;
+      }
+      this._lastSeq = data.seq;
+    }
+
+    // 送信側の時計とのずれ: 一番早く届いたフレームを基準にする
+    const offset = now - data.t;
+    if (this._offset == null || offset < this._offset) {
+      this._offset = offset;
+    }
+
+    frames.push(data);
+    if (frames.length > this._maxFrames) {
+      frames.shift();
+    }
+  }
+
+  /**
+   * 指定時刻のパラメータを返す。フレームがない場合はnull。
+   *
+   * @param now 現在時刻 (performance.now())
+   */
+  public sample(now: number): any {
+    const frames = this._frames;
+    if (frames.length == 0) {
+      return null;
+    }
+
+    // 送信側の時計での再生時刻
+    const t = now - this._offset - this._playoutDelay;
+
+    // 再生時刻より前のフレームは最後の1枚だけ残す
+    while (frames.length > 1 && frames[1].t <= t) {
+      frames.shift();
+    }
+
+    const a = frames[0];
+    if (frames.length == 1 || t <= a.t) {
+      return a;
+    }
+
+    const b = frames[1];
+    const w = (t - a.t) / (b.t - a.t);
+    const result: any = {};
+
+    for (let i = 0; i < InterpolatedKeys.length; i++) {
+      const key = InterpolatedKeys[i];
+      result[key] = a[key] + (b[key] - a[key]) * w;
+    }
+    for (let i = 0; i < SteppedKeys.length; i++) {
+      const key = SteppedKeys[i];
+      result[key] = a[key];
+    }
+
+    return result;
+  }
+
+  _playoutDelay: number;
+  _maxFrames: number;
+  _frames: any[];
+  _offset: number;
+  _lastSeq: number;
+  _lost: number; // 届かなかった(または送られなかった)フレーム数
+}
@@ -16,6 +16,8 @@ import { LAppPal } from './lapppal';
 
 import { LAppView } from './lappview';
 import { io } from "socket.io-client";
+import { decodeParamFrame } from './lappwire';
+import { LAppInterpolator } from './lappinterpolator';
 
 export enum Expression {
   None,
@@ -85,7 +87,20 @@ export class LAppLive2DManager {
 
   onSocketDataRecv(data) {
     // console.log('[lappmodel] [onSocketDataRecv] data: ', data);
+    // バイナリフレーム (python main.py --binary)
+    if (data instanceof ArrayBuffer) {
+      data = decodeParamFrame(data);
+    }
+
     if (data) {
+      // 複数の顔をトラッキングしている場合は自分のチャンネルの顔だけに追従する
+      if (data.face !== undefined && data.face != this._faceChannel) {
+        return;
+      }
+
+      // タイムスタンプ付きのフレームは補間して描画のたびに反映する(onUpdate)
+      this._interpolator.push(data, performance.now());
+
       if (this._exp != Expression.Surprise) {
 
       
@@ -123,6 +138,26 @@ export class LAppLive2DManager {
     }
   }
 
+  /**
+   * 追従する顔のチャンネルを変更する
+   *
+   * @param channel Python側の顔のチャンネル(フレームのface)
+   */
+  public setFaceChannel(channel: number): void {
+    this._faceChannel = channel;
+    // 別の顔のフレームと補間しないようにバッファを作り直す
+    this._interpolator = new LAppInterpolator();
+  }
+
+  /**
+   * URLで指定された顔のチャンネルを返す(例: index.html?face=1)、既定は0
+   * 顔ごとにページを開けば、複数の顔をそれぞれのアバターで表示できる
+   */
+  public static faceChannelFromURL(): number {
+    const face = parseInt(new URLSearchParams(window.location.search).get('face'), 10);
+    return isNaN(face) || face < 0 ? 0 : face;
+  }
+
   public updatePregressBar(exp) {
     if (this._nowExp == Expression.None) { //start exp
       this._nowExp = exp;
@@ -280,6 +315,8 @@ export class LAppLive2DManager {
   public onUpdate(index: number, r: number, g: number, b: number, a: number): void {
     const { width, height } = canvas_gl;
 
+    this.applyInterpolatedParams();
+
     const modelCount: number = this._models.getSize();
     // console.log('modelCount:', modelCount);
 
@@ -307,6 +344,31 @@ export class LAppLive2DManager {
     // }
   }
 
+  /**
+   * 補間したパラメータを反映する
+   */
+  public applyInterpolatedParams(): void {
+    if (this._exp == Expression.Surprise) {
+      return;
+    }
+
+    const data = this._interpolator.sample(performance.now());
+    if (data == null) {
+      return;
+    }
+
+    this._roll = data.roll;
+    this._pitch = data.pitch;
+    this._yaw = data.yaw;
+    this._eyeLOpen = data.eyeLOpen;
+    this._eyeROpen = data.eyeROpen;
+    this._mouthOpen = data.mouthOpen;
+    this._mouthForm = data.mouthForm;
+
+    this._eyeBallX = data.eyeBallX;
+    this._eyeBallY = data.eyeBallY;
+  }
+
   /**
    * 次のシーンに切りかえる
    * サンプルアプリケーションではモデルセットの切り替えを行う。
@@ -345,6 +407,8 @@ export class LAppLive2DManager {
     this._eyeROpen = 1;
     this._mouthOpen = 0;
     this._mouthForm = 0;
+    this._faceChannel = LAppLive2DManager.faceChannelFromURL();
+    this._interpolator = new LAppInterpolator();
 
     this._view = LAppDelegate.getInstance()._view;
     this._exp = Expression.None;
@@ -372,6 +436,8 @@ export class LAppLive2DManager {
   _eyeROpen: number;
   _mouthOpen: number;
   _mouthForm: number;
+  _faceChannel: number; // 追従する顔のチャンネル
+  _interpolator: LAppInterpolator; // パラメータのジッターバッファ
 
   _view: LAppView; // View情報
   _nowExp: number;
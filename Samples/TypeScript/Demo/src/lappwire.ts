@@ -0,0 +1,51 @@
+/**
+ * Python側(python/wire.py)が送るバイナリのパラメータフレームを復号する。
+ *
+ * uint8 version, uint8 count, uint16 face, uint32 seq, float64 t,
+ * float32 params[count] (little endian)
+ */
+
+export const WireVersion = 2;
+
+// python/wire.py の PARAM_KEYS と同じ順番
+export const ParamKeys: string[] = [
+  'roll',
+  'pitch',
+  'yaw',
+  'eyeLOpen',
+  'eyeROpen',
+  'mouthOpen',
+  'mouthForm',
+  'eyeBallX',
+  'eyeBallY'
+];
+
+const HeaderSize = 16;
+
+/**
+ * バイナリフレームをJSONで送られていた時と同じ形のオブジェクトに変換する。
+ *
+ * @param buffer 受信したデータ
+ * @return パラメータ、未対応のフレームの場合はnull
+ */
+export function decodeParamFrame(buffer: ArrayBuffer): any {
+  const view = new DataView(buffer);
+  const version = view.getUint8(0);
+  const count = view.getUint8(1);
+
+  if (version != WireVersion || count != ParamKeys.length) {
+    return null;
+  }
+
+  const data: any = {
+    face: view.getUint16(2, true),
+    seq: view.getUint32(4, true),
+    t: view.getFloat64(8, true)
+  };
+
+  for (let i = 0; i < count; i++) {
+    data[ParamKeys[i]] = view.getFloat32(HeaderSize + i * 4, true);
+  }
+
+  return data;
+}
@@ -0,0 +1,172 @@
+"""
+Replay a recorded session at max speed and report the FPS and the
+p50/ p95/ p99 latency of every stage of the tracking pipeline
+
+    python benchmark.py --source session.npz
+    python benchmark.py --source session.avi --json result.json
+    python benchmark.py --source session.npz --baseline result.json
+
+A landmark stream (.npz) skips FaceMesh, so it runs without mediapipe
+and a GPU, e.g. on CI.
+"""
+
+from argparse import ArgumentParser
+import json
+import sys
+import time
+
+import numpy as np
+
+from facial_features import NUM_MESH_POINTS
+from tracker import FaceTracker
+from replay import LandmarkStream, is_landmark_stream, open_capture
+
+STAGES = ['capture', 'facemesh', 'solvePnP', 'features', 'stabilizers', 'emit']
+
+
+def percentiles(samples):
+    """Return the stats of a list of durations in seconds, in ms"""
+    if not samples:
+        return None
+
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000.0, [50, 95, 99])
+    return {'p50': p50, 'p95': p95, 'p99': p99, 'count': len(samples)}
+
+
+def run(source, repeat=1):
+    """Replay `source` `repeat` times, return the report as a dict"""
+    timings = {stage: [] for stage in STAGES}
+    frames = 0
+
+    if is_landmark_stream(source):
+        cap = LandmarkStream(source)
+        detector = None
+        frame_size = cap.frame_size
+    else:
+        # only needed for video sources
+        from facial_landmark import FaceMeshDetector
+
+        cap, _ = open_capture(source)
+        detector = FaceMeshDetector()
+        success, img = cap.read()
+        frame_size = (img.shape[0], img.shape[1])
+
+    tracker = FaceTracker(frame_size)
+    clock = time.perf_counter
+
+    start = clock()
+    for i in range(repeat):
+        if i > 0:
+            if detector is None:
+                cap.rewind()
+            else:
+                cap.release()
+                cap, _ = open_capture(source)
+
+        while True:
+            t0 = clock()
+            success, item = cap.read()
+            t1 = clock()
+            if not success:
+                break
+            timings['capture'].append(t1 - t0)
+            frames += 1
+
+            if detector is None:
+                faces = item
+            else:
+                t0 = clock()
+                _, faces = detector.findFaceLandmarks(item, draw=False)
+                timings['facemesh'].append(clock() - t0)
+
+            if not len(faces):
+                tracker.reset()
+                continue
+
+            face = faces[0]
+            image_points = face[:NUM_MESH_POINTS]
+
+            t0 = clock()
+            pose = tracker.solve_pose(image_points)
+            t1 = clock()
+            features = tracker.extract_features(face)
+            t2 = clock()
+            tracker.stabilize(pose, features)
+            data = tracker.avatar_params(features)
+            t3 = clock()
+            # socket.io sends the parameters as JSON
+            json.dumps(data)
+            t4 = clock()
+
+            timings['solvePnP'].append(t1 - t0)
+            timings['features'].append(t2 - t1)
+            timings['stabilizers'].append(t3 - t2)
+            timings['emit'].append(t4 - t3)
+
+    elapsed = clock() - start
+    cap.release()
+
+    return {
+        'source': str(source),
+        'frames': frames,
+        'fps': frames / elapsed if elapsed > 0 else 0.0,
+        'stages': {stage: percentiles(timings[stage]) for stage in STAGES},
+    }
+
+
+def print_report(report):
+    print("%s: %d frames, %.1f FPS" % (report['source'], report['frames'], report['fps']))
+    print("%-12s %9s %9s %9s" % ('stage', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for stage in STAGES:
+        stats = report['stages'][stage]
+        if stats is None:
+            print("%-12s %9s %9s %9s" % (stage, '-', '-', '-'))
+        else:
+            print("%-12s %9.3f %9.3f %9.3f" % (stage, stats['p50'], stats['p95'], stats['p99']))
+
+
+def compare(report, baseline, tolerance):
+    """Return the list of stages whose p95 regressed by more than tolerance"""
+    regressions = []
+    for stage in STAGES:
+        new, old = report['stages'].get(stage), baseline['stages'].get(stage)
+        if new is None or old is None:
+            continue
+        if new['p95'] > old['p95'] * (1.0 + tolerance):
+            regressions.append("%s: p95 %.3f ms -> %.3f ms" % (stage, old['p95'], new['p95']))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.add_argument("--source", type=str, required=True,
+                        help="recorded video file or landmark stream (.npz)")
+
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="replay the session several times")
+
+    parser.add_argument("--json", type=str, default=None,
+                        help="write the report to this file")
+
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="fail if a stage p95 is slower than in this report")
+
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative p95 regression against the baseline")
+    args = parser.parse_args()
+
+    report = run(args.source, args.repeat)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for line in regressions:
+            print("regression:", line)
+        if regressions:
+            sys.exit(1)
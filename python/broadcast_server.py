@@ -0,0 +1,133 @@
+"""
+In-process replacement of the Node relay (`socket server.js`)
+
+The tracker hosts the socket.io endpoint of the web client itself and
+broadcasts every parameter frame as a `jsClient` event, which removes one
+process and one (de)serialization from the latency-critical path.
+Frames sent as `msg` by other clients are relayed like the Node server does.
+
+Every web client has a latest-value slot per face: when a client does not
+keep up, a frame still waiting is replaced by the newer frame of the same
+face instead of delaying the others.
+"""
+
+import asyncio
+import threading
+
+import socketio
+from aiohttp import web
+
+from wire import FrameEncoder
+
+
+class BroadcastServer:
+    """socket.io server running on its own event loop thread."""
+
+    def __init__(self, host='localhost', port=5252, binary=False):
+        self.host = host
+        self.port = port
+        self.encoder = FrameEncoder() if binary else None
+
+        self.sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*')
+        self.sio.on('connect', self._on_connect)
+        self.sio.on('disconnect', self._on_disconnect)
+        self.sio.on('msg', self._on_msg)
+
+        self.app = web.Application()
+        self.sio.attach(self.app)
+
+        # sid -> (mailbox {face: frame}, wakeup event, sender task)
+        self.clients = {}
+
+        # counters, dropped counts the replaced frames and the failed emits
+        self.sent = 0
+        self.dropped = 0
+
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.runner = web.AppRunner(self.app)
+            self.loop.run_until_complete(self.runner.setup())
+            self.loop.run_until_complete(web.TCPSite(self.runner, self.host, self.port).start())
+        except OSError as e:
+            self._error = e
+            self._ready.set()
+            return
+
+        print('listening on %d' % self.port)
+        self._ready.set()
+        self.loop.run_forever()
+
+    def emit(self, event, data):
+        """Broadcast a parameter frame to every web client, thread-safe"""
+        face = data.get('face') if isinstance(data, dict) else None
+        if self.encoder is not None and isinstance(data, dict):
+            data = self.encoder.encode(data)
+        self.loop.call_soon_threadsafe(self._broadcast, face, data, None)
+
+    def disconnect(self, timeout=2.0):
+        if not self.loop.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+    def _broadcast(self, face, data, skip_sid):
+        for sid, (mailbox, wakeup, _) in self.clients.items():
+            if sid == skip_sid:
+                continue
+
+            # slow consumer, replace the stale frame of this face
+            if face in mailbox:
+                self.dropped += 1
+            mailbox[face] = data
+            wakeup.set()
+
+    async def _sender(self, sid, mailbox, wakeup):
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+
+            items = list(mailbox.values())
+            mailbox.clear()
+
+            for data in items:
+                try:
+                    await self.sio.emit('jsClient', data, to=sid)
+                except Exception:
+                    # lose this frame, not the client
+                    self.dropped += 1
+                    continue
+                self.sent += 1
+
+    async def _on_connect(self, sid, environ, auth=None):
+        print('socket [%s] connected' % sid)
+        mailbox, wakeup = {}, asyncio.Event()
+        self.clients[sid] = (mailbox, wakeup, asyncio.ensure_future(self._sender(sid, mailbox, wakeup)))
+
+    async def _on_disconnect(self, sid):
+        print('socket [%s] disconnected' % sid)
+        _, _, task = self.clients.pop(sid, (None, None, None))
+        if task is not None:
+            task.cancel()
+
+    async def _on_msg(self, sid, data):
+        # same as socket.broadcast.emit('jsClient', data) of the Node relay
+        face = data.get('face') if isinstance(data, dict) else None
+        self._broadcast(face, data, sid)
+
+    async def _shutdown(self):
+        for _, _, task in self.clients.values():
+            task.cancel()
+        self.clients.clear()
+        await self.runner.cleanup()
@@ -6,6 +6,11 @@ import cv2
 import numpy as np
 from enum import Enum
 
+# number of landmarks produced by FaceMesh with refine_landmarks=True
+NUM_MESH_POINTS = 468
+NUM_IRIS_POINTS = 10
+NUM_LANDMARKS = NUM_MESH_POINTS + NUM_IRIS_POINTS
+
 class Eyes(Enum):
     LEFT = 1
     RIGHT = 2
@@ -200,3 +205,71 @@ class FacialFeatures:
         y_rate = (np.dot(vec_eye_h_eye_l, vec_eye_h_iris) / (np.linalg.norm(eye_y_high - eye_y_low) + 1e-06)) / (np.linalg.norm(eye_y_high - eye_y_low) + 1e-06)
 
         return x_rate, y_rate
+
+
+class FeatureEngine:
+    """
+    Precompiled version of FacialFeatures: every landmark index pair is
+    stored as an integer array, so all the ratios of a face come from one
+    gather and a handful of vectorized operations.
+
+    compute() takes a (478, 2) face and returns
+        [ear_left, ear_right, x_ratio_left, y_ratio_left,
+         x_ratio_right, y_ratio_right, mar, mouth_distance]
+    compute_batch() does the same for (frames, 478, 2) and returns (frames, 8).
+    """
+
+    def __init__(self):
+        left = np.array(FacialFeatures.eye_key_indicies[0])
+        right = np.array(FacialFeatures.eye_key_indicies[1])
+        eyes = np.stack([left, right])
+
+        # eye_aspect_ratio: |mid(10, 11) - mid(2, 3)| + |mid(13, 14) - mid(5, 6)|
+        # of the eye contour, shape (eye, pair, point of the pair)
+        self.mid_first = eyes[:, [10, 13]]
+        self.mid_second = eyes[:, [11, 14]]
+        self.mid_first_end = eyes[:, [2, 5]]
+        self.mid_second_end = eyes[:, [3, 6]]
+
+        # (start, end) of every distance we need
+        self.segments = np.array([
+            [left[0], left[8]], [right[8], right[0]],       # eye width, p1 -> p4
+            [left[12], left[4]], [right[12], right[4]],     # eye height, high -> low
+            [105, 2], [334, 2], [6, 2],                     # eyebrow scale
+            [81, 178], [13, 14], [311, 402],                # mouth height
+            [78, 308],                                      # mouth width
+        ])
+
+        # iris centers and the eye corners / tops they are projected from
+        self.iris = np.array([NUM_MESH_POINTS, NUM_MESH_POINTS + 5])
+        self.eye_start = self.segments[0:2, 0]
+        self.eye_top = self.segments[2:4, 0]
+
+    def compute(self, face):
+        return self.compute_batch(face[None])[0]
+
+    def compute_batch(self, faces):
+        pts = np.asarray(faces, dtype=np.float64)
+
+        mid_a = (pts[:, self.mid_first] + pts[:, self.mid_second]) / 2
+        mid_b = (pts[:, self.mid_first_end] + pts[:, self.mid_second_end]) / 2
+        ear_num = np.linalg.norm(mid_a - mid_b, axis=-1).sum(axis=-1)
+
+        seg = pts[:, self.segments[:, 1]] - pts[:, self.segments[:, 0]]
+        dist = np.linalg.norm(seg, axis=-1)
+
+        # https://downloads.hindawi.com/journals/cmmm/2020/1038906.pdf
+        # Fig (3)
+        ear = ear_num / (2 * dist[:, 0:2] + 1e-6) * dist[:, 4:6] / dist[:, 6:7]
+
+        # projection of the iris on the eye width / height
+        iris = pts[:, self.iris]
+        x_rate = np.einsum('fij,fij->fi', iris - pts[:, self.eye_start], seg[:, 0:2]) / (dist[:, 0:2] + 1e-6) ** 2
+        y_rate = np.einsum('fij,fij->fi', iris - pts[:, self.eye_top], seg[:, 2:4]) / (dist[:, 2:4] + 1e-6) ** 2
+
+        mar = dist[:, 7:10].sum(axis=-1) / (2 * dist[:, 10] + 1e-6)
+
+        return np.stack([ear[:, 0], ear[:, 1],
+                         x_rate[:, 0], y_rate[:, 0],
+                         x_rate[:, 1], y_rate[:, 1],
+                         mar, dist[:, 10]], axis=-1)
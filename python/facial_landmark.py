@@ -6,12 +6,49 @@ import cv2
 import mediapipe as mp
 import numpy as np
 
+from facial_features import NUM_MESH_POINTS, NUM_LANDMARKS
+
+# A NormalizedLandmarkList as FaceMesh serializes it: per landmark the tag
+# and length of the submessage, then x, y and z, each a tag and a float32.
+# Read as an array of these records, the landmarks are copied without
+# creating a Python object per landmark.
+LANDMARK_RECORD = np.dtype([
+    ('tag', 'u1'), ('size', 'u1'),
+    ('x_tag', 'u1'), ('x', '<f4'),
+    ('y_tag', 'u1'), ('y', '<f4'),
+    ('z_tag', 'u1'), ('z', '<f4'),
+])
+
+
+def copy_landmarks(face_landmarks, out):
+    """
+    Copy the normalized (x, y) of a NormalizedLandmarkList to out (N x 2).
+    Falls back to reading landmark by landmark when the serialized layout
+    differs from LANDMARK_RECORD (e.g. visibility set).
+    """
+    data = face_landmarks.SerializeToString()
+    if len(data) == len(out) * LANDMARK_RECORD.itemsize:
+        records = np.frombuffer(data, dtype=LANDMARK_RECORD)
+        if ((records['tag'] == 0x0a) & (records['size'] == LANDMARK_RECORD.itemsize - 2) &
+                (records['x_tag'] == 0x0d) & (records['y_tag'] == 0x15) & (records['z_tag'] == 0x1d)).all():
+            out[:, 0] = records['x']
+            out[:, 1] = records['y']
+            return
+
+    out.reshape(-1)[:] = np.fromiter(
+        (v for lmk in face_landmarks.landmark for v in (lmk.x, lmk.y)),
+        dtype=np.float32, count=len(out) * 2)
+
+
 class FaceMeshDetector:
     def __init__(self,
                  static_image_mode=False,
                  max_num_faces=1,
                  min_detection_confidence=0.5,
-                 min_tracking_confidence=0.5):
+                 min_tracking_confidence=0.5,
+                 roi_tracking=False,
+                 roi_margin=0.5,
+                 roi_full_interval=30):
 
         self.static_image_mode = static_image_mode
         self.max_num_faces = max_num_faces
@@ -32,42 +69,192 @@ class FaceMeshDetector:
         self.mp_drawing = mp.solutions.drawing_utils
         self.drawing_spec = self.mp_drawing.DrawingSpec(thickness=1, circle_radius=1)
 
-    def findFaceMesh(self, img, draw=True):
-        # convert the img from BRG to RGB
-        img = cv2.cvtColor(cv2.flip(img, 1), cv2.COLOR_BGR2RGB)
+        # preallocated landmark buffer in pixel coordinates, (faces, 478, 2)
+        # mesh_points and iris_points are views into it
+        self.landmarks = np.zeros((self.max_num_faces, NUM_LANDMARKS, 2), dtype=np.float32)
+        self.mesh_points = self.landmarks[:, :NUM_MESH_POINTS]
+        self.iris_points = self.landmarks[:, NUM_MESH_POINTS:]
+        self.num_faces = 0
+
+        # ROI tracking: run FaceMesh on a crop around the faces of the
+        # previous frame, roi_margin is the margin added on each side
+        # relative to the size of the face box. While less than max_num_faces
+        # faces are tracked, every roi_full_interval frames run on the full
+        # frame, so new faces outside the crop are found.
+        self.roi_tracking = roi_tracking
+        self.roi_margin = roi_margin
+        self.roi_full_interval = roi_full_interval
+        self.roi = None
+        self._since_full_frame = 0
+
+        # cheap face detector of the idle mode, created on first use
+        self._face_detection = None
+
+        # persistent destination buffers of the preprocessing
+        self._img_rgb = None
+        self._img_bgr = None
+
+        # number of full-frame copies done by the last call, and in total
+        self.frame_copies = 0
+        self.total_frame_copies = 0
+        self.frame_count = 0
+
+    def preprocess(self, img, draw=True, roi=None):
+        """
+        Flip the frame and convert it to RGB for FaceMesh, writing into
+        persistent buffers instead of allocating new images.
+        `roi` is an optional (x0, y0, x1, y1) box in flipped coordinates,
+        only this part of the frame is converted if given.
+        Return (img_rgb, img_bgr), img_bgr is the flipped BGR canvas to draw
+        on, or None when there is nothing to draw.
+        """
+        if self._img_rgb is None or self._img_rgb.shape != img.shape:
+            self._img_rgb = np.empty_like(img)
+            self._img_bgr = np.empty_like(img)
+
+        if roi is None:
+            # convert the img from BRG to RGB, then flip it in place
+            self._img_rgb.flags.writeable = True
+            cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self._img_rgb)
+            cv2.flip(self._img_rgb, 1, dst=self._img_rgb)
+            img_rgb = self._img_rgb
+            self.frame_copies += 1
+        else:
+            # the box is mirrored back to find the crop in the input frame
+            x0, y0, x1, y1 = roi
+            w = img.shape[1]
+            img_rgb = cv2.cvtColor(img[y0:y1, w - x1:w - x0], cv2.COLOR_BGR2RGB)
+            cv2.flip(img_rgb, 1, dst=img_rgb)
+
+        # the flipped BGR frame is only needed as a drawing canvas, so we
+        # flip the input again instead of converting RGB back to BGR
+        img_bgr = None
+        if draw:
+            img_bgr = cv2.flip(img, 1, dst=self._img_bgr)
+            self.frame_copies += 1
+
+        return img_rgb, img_bgr
+
+    def findFaceLandmarks(self, img, draw=True):
+        """
+        Same as findFaceMesh, but return the landmarks as a float32 array of
+        shape (faces, 478, 2) without rounding. The array is a view into
+        self.landmarks and is overwritten by the next call, copy it if it has
+        to outlive the current frame. So is the returned image, which is None
+        when draw is False.
+        """
+        self.frame_copies = 0
+
+        roi = self.roi
+        if roi is not None and self.num_faces < self.max_num_faces:
+            # look for new faces outside the crop from time to time
+            self._since_full_frame += 1
+            if self._since_full_frame >= self.roi_full_interval:
+                roi = None
+        if roi is None:
+            self._since_full_frame = 0
+
+        img_rgb, img_bgr = self.preprocess(img, draw, roi)
+        self.detect(img_rgb, roi)
+
+        # lost the face in the crop, fall back to the full frame
+        if self.num_faces == 0 and roi is not None:
+            img_rgb, _ = self.preprocess(img, False)
+            roi = None
+            self.detect(img_rgb, roi)
 
+        if self.roi_tracking:
+            self.roi = self.face_box(img.shape) if self.num_faces else None
+
+        self.total_frame_copies += self.frame_copies
+        self.frame_count += 1
+
+        if draw and self.results.multi_face_landmarks:
+            # the landmarks are normalized to the crop, so draw on a view of it
+            canvas = img_bgr
+            if roi is not None:
+                x0, y0, x1, y1 = roi
+                canvas = img_bgr[y0:y1, x0:x1]
+
+            for face_landmarks in self.results.multi_face_landmarks:
+                self.mp_drawing.draw_landmarks(
+                    image = canvas,
+                    landmark_list = face_landmarks,
+                    connections = self.mp_face_mesh.FACEMESH_TESSELATION,
+                    landmark_drawing_spec = self.drawing_spec,
+                    connection_drawing_spec = self.drawing_spec)
+
+        return img_bgr, self.landmarks[:self.num_faces]
+
+    def detect(self, img_rgb, roi=None):
+        """
+        Run FaceMesh on img_rgb and fill self.landmarks in full-frame pixel
+        coordinates, `roi` is the box img_rgb was cropped from, if any.
+        """
         # To improve performance, optionally mark the image as not writeable to
         # pass by reference.
-        img.flags.writeable = False
-        self.results = self.face_mesh.process(img)
-
-        # Draw the face mesh annotations on the image.
-        img.flags.writeable = True
-        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        img_rgb.flags.writeable = False
+        self.results = self.face_mesh.process(img_rgb)
 
-        self.imgH, self.imgW, self.imgC = img.shape
+        h, w = img_rgb.shape[:2]
+        scale = np.array([w, h], dtype=np.float32)
+        offset = np.zeros(2, dtype=np.float32)
+        if roi is not None:
+            offset[:] = roi[:2]
 
-        self.faces = []
+        self.num_faces = 0
 
         if self.results.multi_face_landmarks:
             for face_landmarks in self.results.multi_face_landmarks:
-                if draw:
-                    self.mp_drawing.draw_landmarks(
-                        image = img,
-                        landmark_list = face_landmarks,
-                        connections = self.mp_face_mesh.FACEMESH_TESSELATION,
-                        landmark_drawing_spec = self.drawing_spec,
-                        connection_drawing_spec = self.drawing_spec)
-
-                face = []
-                for id, lmk in enumerate(face_landmarks.landmark):
-                    x, y = int(lmk.x * self.imgW), int(lmk.y * self.imgH)
-                    face.append([x, y])
-
-                    # show the id of each point on the image
-                    # cv2.putText(img, str(id), (x-4, y-4), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1, cv2.LINE_AA)
-
-                self.faces.append(face)
+                # normalized (x, y) of every landmark, mapped to pixels in place
+                face = self.landmarks[self.num_faces]
+                copy_landmarks(face_landmarks, face)
+                np.multiply(face, scale, out=face)
+                np.add(face, offset, out=face)
+
+                self.num_faces += 1
+
+    def face_box(self, shape):
+        """
+        Return the (x0, y0, x1, y1) box around the detected faces plus the
+        margin, clipped to the frame, or None if it would cover most of it.
+        """
+        points = self.landmarks[:self.num_faces].reshape(-1, 2)
+        (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+
+        margin = self.roi_margin * max(x1 - x0, y1 - y0)
+        frame_h, frame_w = shape[:2]
+
+        x0 = int(max(x0 - margin, 0))
+        y0 = int(max(y0 - margin, 0))
+        x1 = int(min(x1 + margin, frame_w))
+        y1 = int(min(y1 + margin, frame_h))
+
+        if x1 <= x0 or y1 <= y0 or (x1 - x0) * (y1 - y0) > 0.8 * frame_w * frame_h:
+            return None
+
+        return (x0, y0, x1, y1)
+
+    def detectPresence(self, img, scale=0.25):
+        """
+        Cheap check whether there is any face, with the face detection model
+        on a downscaled frame and without landmarks
+        """
+        if self._face_detection is None:
+            self._face_detection = mp.solutions.face_detection.FaceDetection(
+                model_selection=0,
+                min_detection_confidence=self.min_detection_confidence)
+
+        small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(small, cv2.COLOR_BGR2RGB, dst=small)
+
+        return bool(self._face_detection.process(small).detections)
+
+    def findFaceMesh(self, img, draw=True):
+        """Return the image and the landmarks of every face as lists of integer [x, y]"""
+        img, landmarks = self.findFaceLandmarks(img, draw)
+
+        self.faces = landmarks.astype(np.int32).tolist()
 
         return img, self.faces
 
@@ -0,0 +1,93 @@
+"""
+Hybrid landmark tracking: FaceMesh on keyframes, optical flow in between
+
+FaceMesh runs every `keyframe_interval` frames. In between, the landmarks of
+the last frame are propagated with pyramidal Lucas-Kanade optical flow on a
+downscaled grayscale frame. A new keyframe is forced as soon as too many
+points are lost or the flow error gets too large (drift check).
+"""
+
+import cv2
+import numpy as np
+
+
+class FlowLandmarkTracker:
+    """
+    Drop-in replacement of FaceMeshDetector.findFaceLandmarks wrapping a
+    detector, the other calls are forwarded to it.
+    """
+
+    def __init__(self, detector, keyframe_interval=5, scale=0.5,
+                 min_tracked=0.9, max_error=12.0):
+        self.detector = detector
+        self.keyframe_interval = keyframe_interval
+        self.scale = scale
+        self.min_tracked = min_tracked
+        self.max_error = max_error
+
+        self.lk_params = dict(
+            winSize=(15, 15),
+            maxLevel=2,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+        self.landmarks = np.zeros_like(detector.landmarks)
+        self.num_faces = 0
+
+        self.prev_gray = None
+        self.since_keyframe = 0
+
+        # counters
+        self.keyframes = 0
+        self.flow_frames = 0
+
+    def __getattr__(self, name):
+        return getattr(self.detector, name)
+
+    def gray(self, img):
+        """Downscaled, flipped grayscale frame, in the coordinates of the landmarks"""
+        small = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.flip(gray, 1, dst=gray)
+
+    def findFaceLandmarks(self, img, draw=False):
+        gray = self.gray(img)
+
+        if (self.prev_gray is not None and self.num_faces > 0
+                and self.since_keyframe < self.keyframe_interval - 1
+                and self.propagate(gray)):
+            self.since_keyframe += 1
+            self.flow_frames += 1
+            self.prev_gray = gray
+            return None, self.landmarks[:self.num_faces]
+
+        # keyframe
+        img_facemesh, faces = self.detector.findFaceLandmarks(img, draw)
+        self.num_faces = len(faces)
+        self.landmarks[:self.num_faces] = faces
+        self.since_keyframe = 0
+        self.keyframes += 1
+        self.prev_gray = gray
+
+        return img_facemesh, self.landmarks[:self.num_faces]
+
+    def propagate(self, gray):
+        """Move the landmarks with optical flow, return False if a keyframe is needed"""
+        faces = self.landmarks[:self.num_faces]
+        prev_pts = (faces.reshape(-1, 1, 2) * self.scale).astype(np.float32)
+
+        next_pts, status, error = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray, gray, prev_pts, None, **self.lk_params)
+
+        status = status.reshape(-1).astype(bool)
+        if status.mean() < self.min_tracked:
+            return False
+
+        if np.median(error.reshape(-1)[status]) > self.max_error:
+            return False
+
+        # lost points keep their previous position
+        next_pts = next_pts.reshape(-1, 2) / self.scale
+        flat = faces.reshape(-1, 2)
+        flat[status] = next_pts[status]
+
+        return True
@@ -0,0 +1,46 @@
+"""
+Idle state machine of the tracking loop
+
+After `idle_after` frames without any face the loop goes idle: frames are
+only looked at every `check_interval` seconds, with a cheap presence check
+on a downscaled frame instead of FaceMesh. As soon as a face is found again
+the loop snaps back to full rate on the same frame.
+"""
+
+import time
+
+
+class IdleController:
+    """Decide which frames are processed, see the module docstring."""
+
+    def __init__(self, idle_after=30, check_interval=0.5, clock=time.monotonic):
+        self.idle_after = idle_after
+        self.check_interval = check_interval
+        self.clock = clock
+
+        self.idle = False
+        self.empty_frames = 0
+        self._last_check = 0.0
+
+    def should_run(self):
+        """Return True if the current frame has to be looked at"""
+        if not self.idle:
+            return True
+
+        now = self.clock()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            return True
+        return False
+
+    def update(self, found):
+        """Report whether the frame which was looked at had a face"""
+        if found:
+            self.idle = False
+            self.empty_frames = 0
+            return
+
+        self.empty_frames += 1
+        if not self.idle and self.empty_frames >= self.idle_after:
+            self.idle = True
+            self._last_check = self.clock()
@@ -3,6 +3,7 @@ Main program to run the detection
 """
 
 from argparse import ArgumentParser
+import time
 import cv2
 import mediapipe as mp
 import numpy as np
@@ -15,21 +16,42 @@ from platform import system
 # face detection and facial landmark
 from facial_landmark import FaceMeshDetector
 
-# pose estimation and stablization
-from pose_estimator import PoseEstimator
-from stabilizer import Stabilizer
+# pose estimation, facial features and stablization
+from tracker import MultiFaceTracker
 
-# Miscellaneous detections (eyes/ mouth...)
-from facial_features import FacialFeatures, Eyes
+# capture / inference / emit threads
+from pipeline import Pipeline, EndOfStream
+
+# sending the parameters to the web
+from transport import SocketIOTransport, AsyncSocketIOTransport
+
+# change-driven emission
+from send_scheduler import SendScheduler
+
+# optical flow between FaceMesh keyframes
+from flow_tracker import FlowLandmarkTracker
+
+# power saving without faces
+from idle import IdleController
+
+# debug visualisation
+from renderer import DebugRenderer
+
+# timing spans
+from profiler import Profiler
+
+# recorded sessions
+from replay import LandmarkStream, SessionRecorder, capture_time, is_landmark_stream, open_capture
 
 # global variable
 port = 5252         # have to be same as unity
 
 # init TCP connection with unity
 # return the socket connected
-def init_TCP():
-    s = socketio.Client()
-    s.connect('http://localhost:5252/')
+def init_TCP(binary=False, non_blocking=False):
+    if non_blocking:
+        return AsyncSocketIOTransport('http://localhost:5252/', binary=binary)
+    s = SocketIOTransport('http://localhost:5252/', binary=binary)
     return s
 
 def send_info_to_web(s, data):
@@ -38,201 +60,285 @@ def send_info_to_web(s, data):
 def print_debug_msg(data):
     print(data)
 
-def threshold(v, L, H):
-    if L<=v and v<=H: return 0
-    if H<v : return 1
-    if v<L : return -1
-
 def main():
 
-    cap = cv2.VideoCapture(args.cam)
+    source = args.cam if args.source is None else args.source
 
-    # Facemesh
-    detector = FaceMeshDetector()
+    if is_landmark_stream(source):
+        # the stream replays the output of FaceMesh
+        cap = LandmarkStream(source)
+        detector = cap
+        live = False
+        img_size = cap.frame_size
+    else:
+        cap, live = open_capture(source)
 
-    # get a sample frame for pose estimation img
-    success, img = cap.read()
+        # Facemesh
+        detector = FaceMeshDetector(max_num_faces=args.max_faces, roi_tracking=args.roi)
 
-    # Pose estimation related
-    pose_estimator = PoseEstimator((img.shape[0], img.shape[1]))
-    image_points = np.zeros((pose_estimator.model_points_full.shape[0], 2))
+        if args.facemesh_interval > 0:
+            detector = FlowLandmarkTracker(detector, args.facemesh_interval)
 
-    # extra 10 points due to new attention model (in iris detection)
-    iris_image_points = np.zeros((10, 2))
+        # get a sample frame for pose estimation img
+        success, img = cap.read()
+        img_size = (img.shape[0], img.shape[1])
+
+    recorder = None
+    if args.record:
+        recorder = SessionRecorder(args.record, img_size, args.max_faces, record_video=not is_landmark_stream(source))
+
+    profiler = Profiler(
+        enabled=args.profile or bool(args.trace or args.stats_csv or args.stats_port),
+        trace_file=args.trace,
+        csv_file=args.stats_csv)
+    if args.stats_port:
+        profiler.serve(args.stats_port)
+
+    # Pose estimation, facial features and stabilizers
+    # the latency is measured against the wall clock, only for live cameras
+    tracker = MultiFaceTracker(img_size, args.max_faces, profiler, predict=args.predict and live)
+
+    scheduler = None
+    if args.dead_band or args.max_send_rate > 0:
+        scheduler = SendScheduler(
+            epsilons=None if args.dead_band else {},
+            max_rate=args.max_send_rate,
+            keyframe_interval=args.keyframe_interval)
 
-    # Introduce scalar stabilizers for pose.
-    pose_stabilizers = [Stabilizer(
-        state_num=2,
-        measure_num=1,
-        cov_process=0.1,
-        cov_measure=0.1) for _ in range(6)]
+    # Initialize TCP connection
+    socket = None
+    if args.serve:
+        # needs aiohttp, only imported when used
+        from broadcast_server import BroadcastServer
+        socket = BroadcastServer(port=port, binary=args.binary)
+    elif args.connect:
+        socket = init_TCP(binary=args.binary, non_blocking=args.async_transport)
+
+    # only for live cameras: skipping frames by wall-clock time would make
+    # the replay of video files and landmark streams non-deterministic
+    idle = None
+    if args.idle_after > 0 and live:
+        idle = IdleController(args.idle_after, args.idle_interval)
+
+    # annotation and cv2.imshow run in their own thread, headless otherwise
+    renderer = None
+    if args.debug:
+        renderer = DebugRenderer(img_size)
+
+    try:
+        if args.pipeline:
+            run_pipelined(cap, live, detector, tracker, socket, recorder, scheduler, renderer, idle)
+        else:
+            run_sequential(cap, live, detector, tracker, socket, recorder, scheduler, renderer, idle)
+    except KeyboardInterrupt:
+        pass
 
-    # for eyes
-    eyes_stabilizers = [Stabilizer(
-        state_num=2,
-        measure_num=1,
-        cov_process=0.1,
-        cov_measure=0.1) for _ in range(6)]
+    if renderer is not None:
+        renderer.close()
 
-    # for mouth_dist
-    mouth_dist_stabilizer = Stabilizer(
-        state_num=2,
-        measure_num=1,
-        cov_process=0.1,
-        cov_measure=0.1
-    )
+    if args.debug and scheduler is not None:
+        print("frames sent: %d, suppressed: %d" % (scheduler.sent, scheduler.suppressed))
 
+    profiler.close()
+    if args.profile:
+        for name, s in profiler.stats().items():
+            print("%-26s p50 %7.2f ms, p95 %7.2f ms, p99 %7.2f ms" % (name, s['p50'], s['p95'], s['p99']))
 
-    # Initialize TCP connection
-    if args.connect:
-        socket = init_TCP()
+    if recorder is not None:
+        recorder.close()
+
+    if args.debug and isinstance(detector, FlowLandmarkTracker):
+        print("FaceMesh keyframes: %d, optical flow frames: %d" % (detector.keyframes, detector.flow_frames))
+
+    if args.debug and getattr(detector, 'frame_count', 0):
+        print("full-frame copies per frame: %.2f" % (detector.total_frame_copies / detector.frame_count))
+
+    if socket is not None:
+        socket.disconnect()
+
+        if args.debug and isinstance(socket, AsyncSocketIOTransport):
+            print("messages sent: %d, coalesced: %d, dropped: %d" % (socket.sent, socket.coalesced, socket.dropped))
+        elif args.debug and args.serve:
+            print("messages sent: %d, dropped: %d" % (socket.sent, socket.dropped))
+
+    cap.release()
+
+
+def process_frame(detector, tracker, socket, img, recorder=None, scheduler=None, t_capture=None):
+    """Run the whole tracking on one frame, return the landmarks"""
+
+    # Pose estimation by 3 steps:
+    # 1. detect face;
+    # 2. detect landmarks;
+    # 3. estimate pose
+
+    # first two steps, nothing is drawn here (see renderer.py)
+    with tracker.profiler.span('findFaceMesh'):
+        _, faces = detector.findFaceLandmarks(img, draw=False)
+
+    if recorder is not None:
+        recorder.write_landmarks(faces, t_capture)
+
+    process_faces(tracker, socket, faces, scheduler, t_capture)
+
+    return faces
+
+
+def process_faces(tracker, socket, faces, scheduler=None, t_capture=None):
+    """
+    The third step and the emit, t_capture is the time of the capture
+    (see replay.capture_time)
+    """
+
+    # extrapolate the stabilized pose by the measured capture-to-emit latency
+    lead = 0.0
+    if tracker.latency is not None:
+        lead = tracker.latency.lead_frames()
+
+    # every face has its own pose estimator and stabilizers,
+    # the filters step by the time between the captures
+    results = tracker.update(faces, lead, t_capture)
+
+    # send info to web, tagged with the channel id of the face
+    if socket is not None:
+        with tracker.profiler.span('send_info_to_web'):
+            for face_id, data in results:
+                # skip the frames which did not change enough
+                if scheduler is not None and not scheduler.should_send(data, face_id):
+                    continue
+                data['face'] = face_id
+                # capture time in ms, for the interpolation of the web client
+                if t_capture is not None:
+                    data['t'] = t_capture * 1000.0
+                send_info_to_web(socket, data)
+
+    if tracker.latency is not None and t_capture is not None:
+        tracker.latency.observe(t_capture, time.monotonic())
+
+
+def skip_idle_frame(idle, detector, profiler, img):
+    """Return True if the frame is skipped because we are idle without faces"""
+    if idle is None:
+        return False
+
+    if not idle.should_run():
+        return True
+
+    if idle.idle:
+        with profiler.span('detectPresence'):
+            present = detector.detectPresence(img)
+        if not present:
+            idle.update(False)
+            return True
+
+    return False
+
+
+def run_sequential(cap, live, detector, tracker, socket, recorder=None, scheduler=None, renderer=None, idle=None):
+    profiler = tracker.profiler
 
     while cap.isOpened():
-        success, img = cap.read()
+        with profiler.span('capture'):
+            success, img = cap.read()
+        t_capture = capture_time(cap, live)
 
         if not success:
+            # end of a recorded session
+            if not live:
+                break
             print("Ignoring empty camera frame.")
             continue
 
-        # Pose estimation by 3 steps:
-        # 1. detect face;
-        # 2. detect landmarks;
-        # 3. estimate pose
-
-        # first two steps
-        img_facemesh, faces = detector.findFaceMesh(img)
-
-        # flip the input image so that it matches the facemesh stuff
-        img = cv2.flip(img, 1)
-
-        # if there is any face detected
-        if faces:
-            # only get the first face
-            for i in range(len(image_points)):
-                image_points[i, 0] = faces[0][i][0]
-                image_points[i, 1] = faces[0][i][1]
-                
-            for j in range(len(iris_image_points)):
-                iris_image_points[j, 0] = faces[0][j + 468][0]
-                iris_image_points[j, 1] = faces[0][j + 468][1]
-
-            # The third step: pose estimation
-            # pose: [[rvec], [tvec]]
-            pose = pose_estimator.solve_pose_by_all_points(image_points)
-
-            x_ratio_left, y_ratio_left = FacialFeatures.detect_iris(image_points, iris_image_points, Eyes.LEFT)
-            x_ratio_right, y_ratio_right = FacialFeatures.detect_iris(image_points, iris_image_points, Eyes.RIGHT)
-
-
-            ear_left = FacialFeatures.eye_aspect_ratio(image_points, Eyes.LEFT)
-            ear_right = FacialFeatures.eye_aspect_ratio(image_points, Eyes.RIGHT)
-
-            pose_eye = [ear_left, ear_right, x_ratio_left, y_ratio_left, x_ratio_right, y_ratio_right]
-
-            mar = FacialFeatures.mouth_aspect_ratio(image_points)
-            mouth_distance = FacialFeatures.mouth_distance(image_points)
-
-            # print("left eye: %.2f, %.2f" % (x_ratio_left, y_ratio_left))
-            # print("right eye: %.2f, %.2f" % (x_ratio_right, y_ratio_right))
-
-            # print("rvec (y) = (%f): " % (pose[0][1]))
-            # print("rvec (x, y, z) = (%f, %f, %f): " % (pose[0][0], pose[0][1], pose[0][2]))
-            # print("tvec (x, y, z) = (%f, %f, %f): " % (pose[1][0], pose[1][1], pose[1][2]))
-
-            # Stabilize the pose.
-            steady_pose = []
-            pose_np = np.array(pose).flatten()
-
-            for value, ps_stb in zip(pose_np, pose_stabilizers):
-                ps_stb.update([value])
-                steady_pose.append(ps_stb.state[0])
-
-            steady_pose = np.reshape(steady_pose, (-1, 3))
-
-            # stabilize the eyes value
-            steady_pose_eye = []
-            for value, ps_stb in zip(pose_eye, eyes_stabilizers):
-                ps_stb.update([value])
-                steady_pose_eye.append(ps_stb.state[0])
-
-            mouth_dist_stabilizer.update([mouth_distance])
-            steady_mouth_dist = mouth_dist_stabilizer.state[0]
-
-            # print("rvec steady (x, y, z) = (%f, %f, %f): " % (steady_pose[0][0], steady_pose[0][1], steady_pose[0][2]))
-            # print("tvec steady (x, y, z) = (%f, %f, %f): " % (steady_pose[1][0], steady_pose[1][1], steady_pose[1][2]))
-
-            # calculate the roll/ pitch/ yaw
-            # roll: +ve when the axis pointing upward
-            # pitch: +ve when we look upward
-            # yaw: +ve when we look left
-            # print(pose[0][0])
-            # print(np.degrees(steady_pose[0][0]))
-            if steady_pose[0][0] < 0 : steady_pose[0][0] = -steady_pose[0][0]
-            
-            roll = np.clip(np.degrees(steady_pose[0][1]), -30, 30) * 2
-            pitch = np.clip(177 - abs(np.degrees(steady_pose[0][0])), -90, 90) * 3
-            yaw =  np.clip(np.degrees(steady_pose[0][2]), -30, 30) + 3
-            # print("Roll: %.2f, Pitch: %.2f, Yaw: %.2f" % (roll, pitch, yaw))
-            # print("left eye: %.2f, %.2f; right eye %.2f, %.2f"
-            #     % (steady_pose_eye[0], steady_pose_eye[1], steady_pose_eye[2], steady_pose_eye[3]))
-            # print("EAR_LEFT: %.2f; EAR_RIGHT: %.2f" % (ear_left, ear_right))
-            # print("MAR: %.2f; Mouth Distance: %.2f" % (mar, steady_mouth_dist))
-            # eyeBallX = (x_ratio_left + x_ratio_right)/2
-            # eyeBallX = -(steady_pose_eye[2][0] + steady_pose_eye[4][0])/2
-            # eyeBallY = -(steady_pose_eye[3][0] + steady_pose_eye[5][0])/2
-            eyeBallX = -(pose_eye[2] + pose_eye[4])/2
-            eyeBallY = -(pose_eye[3] + pose_eye[5])/2
-            
-            data = {
-                'roll': roll, 'pitch': pitch, 'yaw': yaw,
-                'eyeLOpen': ear_left*6 - 2,
-                'eyeROpen': ear_right*6 - 2,
-                # 'eyeROpen': ear_right*6 - 2,
-                'mouthOpen': mar*1.5,
-                'mouthForm': threshold(mouth_distance,45,50) - 1, 
-                # 'mouthForm': -3, 
-                'eyeBallX': threshold(-eyeBallX,0.45,0.57),
-                # 'eyeBallY': threshold(eyeBallY,-0.55,-0.35),
-                'eyeBallY': 0,
-            }
-            # send info to web
-            if args.connect:
-
-                # for sending to live2d model (Hiyori)
-                # send_info_to_web(socket,
-                #     (roll, pitch, yaw,
-                #     ear_left, ear_right, x_ratio_left, y_ratio_left, x_ratio_right, y_ratio_right,
-                #     mar, mouth_distance)
-                # )
-                send_info_to_web(socket,data)
-
-            if args.debug:
-                # print(mouth_distance)
-                # print(data['eyeLOpen'])
-                # if data['eyeBallX'] != 0:
-                #     print(data['eyeBallX'])
-                pass
-
-
-            # pose_estimator.draw_annotation_box(img, pose[0], pose[1], color=(255, 128, 128))
-
-            # pose_estimator.draw_axis(img, pose[0], pose[1])
-
-            pose_estimator.draw_axes(img_facemesh, steady_pose[0], steady_pose[1])
+        if skip_idle_frame(idle, detector, profiler, img):
+            continue
 
-        else:
-            # reset our pose estimator
-            pose_estimator = PoseEstimator((img_facemesh.shape[0], img_facemesh.shape[1]))
+        if recorder is not None:
+            recorder.write_frame(img)
 
-        if args.debug:
-            cv2.imshow('Facial landmark', img_facemesh)
-   
-        # press "q" to leave
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            socket.disconnect()
-            break
+        faces = process_frame(detector, tracker, socket, img, recorder, scheduler, t_capture)
+        profiler.tick()
+
+        if idle is not None:
+            idle.update(len(faces) > 0)
+
+        if renderer is not None:
+            # cap.read() returns a new frame every time, no copy needed
+            renderer.submit(img, faces, tracker.poses())
+
+            # press "q" in the window to leave
+            if renderer.quit:
+                break
 
-    cap.release()
+
+def run_pipelined(cap, live, detector, tracker, socket, recorder=None, scheduler=None, renderer=None, idle=None):
+    """
+    Same as run_sequential, but capture, FaceMesh inference and the
+    post-processing/ emit run in three threads connected by single-slot
+    queues, so a slow stage drops stale frames instead of queueing them.
+    """
+    profiler = tracker.profiler
+
+    def capture():
+        if not cap.isOpened():
+            raise EndOfStream()
+
+        with profiler.span('capture'):
+            success, img = cap.read()
+        t_capture = capture_time(cap, live)
+
+        if not success:
+            if not live:
+                raise EndOfStream()
+            print("Ignoring empty camera frame.")
+            return None
+        return img, t_capture
+
+    def inference(frame):
+        img, t_capture = frame
+        if skip_idle_frame(idle, detector, profiler, img):
+            return None
+
+        with profiler.span('findFaceMesh'):
+            _, faces = detector.findFaceLandmarks(img, draw=False)
+
+        if idle is not None:
+            idle.update(len(faces) > 0)
+
+        # record the frames which are processed, not the dropped ones
+        if recorder is not None:
+            recorder.write_frame(img)
+            recorder.write_landmarks(faces, t_capture)
+
+        # the landmark buffer of the detector is reused by the next frame
+        return img, faces.copy(), t_capture
+
+    def post_process(result):
+        img, faces, t_capture = result
+        process_faces(tracker, socket, faces, scheduler, t_capture)
+        profiler.tick()
+
+        if renderer is not None:
+            renderer.submit(img, faces, tracker.poses())
+        return True
+
+    pipeline = Pipeline(capture, [inference, post_process])
+    pipeline.start()
+
+    try:
+        while pipeline.is_alive() and pipeline.error is None:
+            pipeline.output.get(timeout=0.05)
+
+            # press "q" in the window to leave
+            if renderer is not None and renderer.quit:
+                break
+    finally:
+        # joins the threads before the caller releases the capture, the
+        # recorder and the socket (also on Ctrl-C), re-raises the exception
+        # of a failed stage
+        pipeline.stop()
+
+    if args.debug:
+        print("dropped frames (inference, post-process):", pipeline.dropped()[:2])
 
 
 if __name__ == "__main__":
@@ -242,13 +348,89 @@ if __name__ == "__main__":
                         help="specify the camera number if you have multiple cameras",
                         default=0)
 
+    parser.add_argument("--source", type=str,
+                        help="read a video file or a recorded landmark stream (.npz) instead of the camera",
+                        default=None)
+
+    parser.add_argument("--record", type=str,
+                        help="record the session to <RECORD>.avi and <RECORD>.npz",
+                        default=None)
+
     parser.add_argument("--connect", action="store_true",
                         help="connect to unity character",
                         default=False)
 
+    parser.add_argument("--serve", action="store_true",
+                        help="host the web client endpoint in this process instead of connecting to socket server.js",
+                        default=False)
+
+    parser.add_argument("--binary", action="store_true",
+                        help="send the parameters as compact binary frames instead of JSON",
+                        default=False)
+
+    parser.add_argument("--dead-band", action="store_true",
+                        help="only send the frames whose parameters moved more than a per-parameter epsilon",
+                        default=False)
+
+    parser.add_argument("--max-send-rate", type=float,
+                        help="maximum number of frames sent per second and face (0: no limit)",
+                        default=0.0)
+
+    parser.add_argument("--keyframe-interval", type=float,
+                        help="send a frame at least every that many seconds, even without motion",
+                        default=1.0)
+
+    parser.add_argument("--async-transport", action="store_true",
+                        help="send from an asyncio thread with a latest-value mailbox, never blocking the tracking",
+                        default=False)
+
+    parser.add_argument("--predict", action="store_true",
+                        help="extrapolate the pose by the measured capture-to-emit latency (live cameras only)",
+                        default=False)
+
     parser.add_argument("--debug", action="store_true",
                         help="showing the camera's image for debugging",
                         default=False)
+
+    parser.add_argument("--pipeline", action="store_true",
+                        help="run capture, inference and emit in separate threads, dropping stale frames",
+                        default=False)
+
+    parser.add_argument("--max-faces", type=int,
+                        help="number of faces tracked at the same time, each on its own channel",
+                        default=1)
+
+    parser.add_argument("--idle-after", type=int,
+                        help="go idle after that many frames without face (0: never, cameras only)",
+                        default=30)
+
+    parser.add_argument("--idle-interval", type=float,
+                        help="seconds between two cheap face checks while idle",
+                        default=0.5)
+
+    parser.add_argument("--facemesh-interval", type=int,
+                        help="run FaceMesh every that many frames and optical flow in between (0: every frame)",
+                        default=0)
+
+    parser.add_argument("--roi", action="store_true",
+                        help="run FaceMesh on a crop around the face of the previous frame",
+                        default=False)
+
+    parser.add_argument("--profile", action="store_true",
+                        help="time every stage and print the stats on exit",
+                        default=False)
+
+    parser.add_argument("--trace", type=str,
+                        help="write the per-frame spans as a Chrome trace (JSON) to this file",
+                        default=None)
+
+    parser.add_argument("--stats-csv", type=str,
+                        help="append the rolling stage stats to this CSV file every few seconds",
+                        default=None)
+
+    parser.add_argument("--stats-port", type=int,
+                        help="serve the rolling stage stats as JSON on this port",
+                        default=None)
     args = parser.parse_args()
 
     # demo code
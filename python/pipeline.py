@@ -0,0 +1,156 @@
+"""
+Staged capture / inference / emit pipeline
+
+Every stage runs in its own thread and the stages are connected by
+single-slot queues which always keep the newest item, so the throughput
+approaches the one of the slowest stage and stale frames are dropped
+instead of piling up behind it.
+"""
+
+import threading
+
+
+class EndOfStream(Exception):
+    """Raised by a pipeline source when there are no more items to produce."""
+    pass
+
+
+class LatestQueue:
+    """Bounded single-slot queue that drops the oldest item on overflow."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._has_item = False
+        self._closed = False
+
+        # number of items overwritten before anyone consumed them
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._has_item:
+                self.dropped += 1
+            self._item = item
+            self._has_item = True
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Return the newest item, waiting for one if the slot is empty.
+        Return None when the queue is closed or the timeout expires.
+        """
+        with self._cond:
+            if not self._has_item and not self._closed:
+                self._cond.wait(timeout)
+
+            if not self._has_item:
+                return None
+
+            item = self._item
+            self._item = None
+            self._has_item = False
+            return item
+
+    def close(self):
+        """Wake up every consumer, the queue returns None once it is empty."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class Pipeline:
+    """
+    Run `source` in a capture thread and every function of `stages` in its
+    own worker thread, each stage consuming the newest output of the
+    previous one. A stage may return None to drop the current item.
+    The output of the last stage is available through `self.output`.
+    An exception in the source or a stage stops the whole pipeline, it is
+    stored in `self.error` and re-raised by `stop()`.
+    """
+
+    def __init__(self, source, stages):
+        self.source = source
+        self.stages = list(stages)
+
+        self.queues = [LatestQueue() for _ in range(len(self.stages) + 1)]
+        self.output = self.queues[-1]
+
+        self._stop = threading.Event()
+        self._threads = []
+
+        # first exception raised by a thread
+        self.error = None
+        self._error_lock = threading.Lock()
+
+    def _fail(self, error):
+        """Remember the first error and shut the other threads down"""
+        with self._error_lock:
+            if self.error is None:
+                self.error = error
+        self._stop.set()
+        for queue in self.queues:
+            queue.close()
+
+    def _run_source(self):
+        try:
+            while not self._stop.is_set():
+                item = self.source()
+                if item is not None:
+                    self.queues[0].put(item)
+        except EndOfStream:
+            pass
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self.queues[0].close()
+
+    def _run_stage(self, index):
+        fn = self.stages[index]
+        in_queue, out_queue = self.queues[index], self.queues[index + 1]
+
+        try:
+            while not self._stop.is_set():
+                item = in_queue.get()
+                if item is None:
+                    if in_queue.closed:
+                        break
+                    continue
+
+                result = fn(item)
+                if result is not None:
+                    out_queue.put(result)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            out_queue.close()
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._run_source, daemon=True)]
+        for i in range(len(self.stages)):
+            self._threads.append(threading.Thread(target=self._run_stage, args=(i,), daemon=True))
+
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop and join every thread, re-raise the error of a failed thread"""
+        self._stop.set()
+        for queue in self.queues:
+            queue.close()
+        for thread in self._threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def dropped(self):
+        """Number of stale items dropped in front of each stage (and the output)"""
+        return [queue.dropped for queue in self.queues]
@@ -3,9 +3,40 @@ Modify from https://github.com/yinguobing/head-pose-estimation/blob/master/pose_
 
 Estimate head pose according to the facial landmarks
 """
+import os
+
 import cv2
 import numpy as np
 
+# parsed model points, shared read-only by every estimator
+_model_points_cache = {}
+
+def load_model_points(filename='model.txt'):
+    """
+    Return the 3D model points of `filename` as a read-only (468, 3) array.
+    The text file is parsed once into a .npy cache next to it, which is
+    memory mapped and shared by every PoseEstimator afterwards.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+
+    if path in _model_points_cache:
+        return _model_points_cache[path]
+
+    cache = os.path.splitext(path)[0] + '.npy'
+    if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(path):
+        model_points = np.loadtxt(path, dtype=np.float32).reshape(-1, 3)
+        try:
+            np.save(cache, model_points)
+        except OSError:
+            # read-only install, keep the parsed points in memory
+            model_points.flags.writeable = False
+            _model_points_cache[path] = model_points
+            return model_points
+
+    model_points = np.load(cache, mmap_mode='r')
+    _model_points_cache[path] = model_points
+    return model_points
+
 class PoseEstimator:
 
     def __init__(self, img_size=(480, 640)):
@@ -29,17 +60,8 @@ class PoseEstimator:
         self.t_vec = None
 
     def get_full_model_points(self, filename='model.txt'):
-        """Get all 468 3D model points from file"""
-        raw_value = []
-
-        with open(filename) as file:
-            for line in file:
-                raw_value.append(line)
-
-        model_points = np.array(raw_value, dtype=np.float32)
-        model_points = np.reshape(model_points, (-1, 3))
-
-        return model_points
+        """Get all 468 3D model points (cached, read-only)"""
+        return load_model_points(filename)
 
     def solve_pose_by_all_points(self, image_points):
         """
@@ -123,3 +145,7 @@ class PoseEstimator:
     def reset_r_vec_t_vec(self):
         self.r_vec = None
         self.t_vec = None
+
+    def reset(self):
+        """Forget the previous pose, the next solve starts without a guess"""
+        self.reset_r_vec_t_vec()
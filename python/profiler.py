@@ -0,0 +1,170 @@
+"""
+Per-frame timing spans of the tracking loop
+
+    profiler = Profiler(enabled=True)
+    with profiler.span('findFaceMesh'):
+        detector.findFaceLandmarks(img)
+    profiler.tick()
+
+Every span feeds a rolling window of durations (the stats), and optionally a
+Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev) of the
+last `trace_max_events` spans.
+The stats can be dumped to a CSV file periodically or served as JSON over
+HTTP. A disabled profiler hands out a shared no-op span, so the
+instrumentation can stay in the hot path.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Profiler:
+    """Collect timing spans, see the module docstring."""
+
+    def __init__(self, enabled=False, window=300, trace_file=None, csv_file=None, csv_interval=5.0,
+                 trace_max_events=100000):
+        self.enabled = enabled
+        self.window = window
+
+        # ring buffer, a long session would grow without bound otherwise
+        # (about 10 minutes of 5 spans per frame at 30 fps)
+        self.trace_file = trace_file
+        self.trace_events = deque(maxlen=trace_max_events) if trace_file else None
+
+        self.csv_file = csv_file
+        self.csv_interval = csv_interval
+        self._last_csv = time.monotonic()
+
+        # the tracking threads append, stats() reads from the HTTP thread
+        self.samples = {}
+        self._lock = threading.Lock()
+        self.frame = 0
+        self._origin = time.perf_counter()
+        self._server = None
+
+    def span(self, name):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name, start, end):
+        """Record a span given its perf_counter start and end"""
+        with self._lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+            samples.append(end - start)
+
+        if self.trace_events is not None:
+            self.trace_events.append({
+                'name': name, 'ph': 'X', 'pid': 0,
+                'tid': threading.get_ident(),
+                'ts': (start - self._origin) * 1e6,
+                'dur': (end - start) * 1e6,
+                'args': {'frame': self.frame},
+            })
+
+    def tick(self):
+        """Mark the end of a frame, dump the CSV when it is due"""
+        if not self.enabled:
+            return
+        self.frame += 1
+
+        if self.csv_file and time.monotonic() - self._last_csv >= self.csv_interval:
+            self._last_csv = time.monotonic()
+            self.dump_csv()
+
+    def stats(self):
+        """Return {stage: {count, mean, p50, p95, p99, max}} in ms over the rolling window"""
+        with self._lock:
+            snapshot = {name: list(samples) for name, samples in self.samples.items()}
+
+        result = {}
+        for name, samples in snapshot.items():
+            values = np.array(samples) * 1000.0
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[name] = {
+                'count': len(values),
+                'mean': float(values.mean()),
+                'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+                'max': float(values.max()),
+            }
+        return result
+
+    def dump_csv(self):
+        write_header = False
+        try:
+            with open(self.csv_file) as file:
+                write_header = not file.read(1)
+        except FileNotFoundError:
+            write_header = True
+
+        with open(self.csv_file, 'a') as file:
+            if write_header:
+                file.write('time,frame,stage,count,mean_ms,p50_ms,p95_ms,p99_ms,max_ms\n')
+            now = time.time()
+            for name, s in self.stats().items():
+                file.write('%.3f,%d,%s,%d,%.3f,%.3f,%.3f,%.3f,%.3f\n' % (
+                    now, self.frame, name, s['count'], s['mean'], s['p50'], s['p95'], s['p99'], s['max']))
+
+    def serve(self, port):
+        """Serve the stats as JSON on http://localhost:<port>/ from a daemon thread"""
+        profiler = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps({'frame': profiler.frame, 'stages': profiler.stats()}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('localhost', port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+        if self.csv_file and self.enabled:
+            self.dump_csv()
+
+        if self.trace_events is not None:
+            with open(self.trace_file, 'w') as file:
+                json.dump({'traceEvents': list(self.trace_events), 'displayTimeUnit': 'ms'}, file)
@@ -0,0 +1,82 @@
+"""
+Debug visualisation running in its own thread
+
+The tracking loop only hands over a snapshot (raw frame, landmarks and
+stabilized poses); flipping, drawing the face mesh and the pose axes and
+cv2.imshow all happen in the renderer thread, so visualisation never costs
+tracking FPS. Stale snapshots are dropped when the renderer falls behind.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+from mediapipe.python.solutions.face_mesh_connections import FACEMESH_TESSELATION
+
+from pipeline import LatestQueue
+from pose_estimator import PoseEstimator
+
+
+class DebugRenderer:
+    """Annotate and show the tracking snapshots, press "q" to set `quit`."""
+
+    def __init__(self, img_size, window='Facial landmark'):
+        self.img_size = img_size
+        self.window = window
+
+        # only used for its camera matrix
+        self.pose_estimator = PoseEstimator(img_size)
+
+        # (start, end) landmark indices of every mesh edge
+        self.connections = np.array(sorted(FACEMESH_TESSELATION), dtype=np.int32)
+
+        self.queue = LatestQueue()
+        self.quit = False
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, img, faces, poses):
+        """
+        img: raw camera frame (not flipped), it must not be written to
+        afterwards, anything else than an uint8 image (e.g. the landmarks
+        of a LandmarkStream) gives a black canvas;
+        faces: (n, 478, 2) landmarks; poses: stabilized poses
+        """
+        self.queue.put((img, np.array(faces, copy=True), poses))
+
+    def close(self):
+        self.queue.close()
+        self._thread.join()
+
+    def render(self, img, faces, poses):
+        """Return the annotated, flipped image"""
+        if not isinstance(img, np.ndarray) or img.dtype != np.uint8:
+            # landmark stream, draw on a black canvas
+            canvas = np.zeros((self.img_size[0], self.img_size[1], 3), dtype=np.uint8)
+        else:
+            canvas = cv2.flip(img, 1)
+
+        for face in faces:
+            lines = np.round(face).astype(np.int32)[self.connections]
+            cv2.polylines(canvas, lines, False, (224, 224, 224), 1)
+
+        for pose in poses:
+            self.pose_estimator.draw_axes(canvas, pose[0], pose[1])
+
+        return canvas
+
+    def _run(self):
+        while True:
+            item = self.queue.get(timeout=0.01)
+            if item is None and self.queue.closed:
+                break
+
+            if item is not None:
+                cv2.imshow(self.window, self.render(*item))
+
+            # press "q" to leave
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self.quit = True
+
+        cv2.destroyWindow(self.window)
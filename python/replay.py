@@ -0,0 +1,136 @@
+"""
+Record tracking sessions to disk and replay them without a webcam
+
+A session is either a video file of the raw camera frames, which is replayed
+through FaceMesh, or a landmark stream (.npz) holding the FaceMesh output of
+every frame, which can be replayed without mediapipe.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+from facial_features import NUM_LANDMARKS
+
+
+def is_landmark_stream(source):
+    return str(source).endswith('.npz')
+
+
+def open_capture(source):
+    """
+    Open a camera (int or digit string) or a video file with cv2.VideoCapture.
+    Return (cap, live), live is False for files, which end instead of
+    delivering empty frames.
+    """
+    if isinstance(source, int) or str(source).isdigit():
+        return cv2.VideoCapture(int(source)), True
+
+    return cv2.VideoCapture(source), False
+
+
+def capture_time(cap, live):
+    """
+    Time of the frame just read, in seconds: time.monotonic() for cameras,
+    the position in the recording for files and landmark streams, so a
+    replay steps the filters by the recorded time between the frames
+    whatever the speed it runs at.
+    """
+    if live:
+        return time.monotonic()
+    return cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+
+class LandmarkStream:
+    """
+    Replay a recorded landmark stream. It acts both as the capture (read)
+    and as the detector (findFaceLandmarks) of the tracking loop.
+    """
+
+    def __init__(self, filename):
+        with np.load(filename) as data:
+            self.landmarks = data['landmarks']
+            self.num_faces = data['num_faces']
+            self.timestamps = data['timestamps']
+            self.frame_size = tuple(int(v) for v in data['frame_size'])
+
+        self.index = 0
+
+    def __len__(self):
+        return len(self.num_faces)
+
+    def isOpened(self):
+        return self.index < len(self)
+
+    def read(self):
+        if not self.isOpened():
+            return False, None
+
+        faces = self.landmarks[self.index, :self.num_faces[self.index]]
+        self.index += 1
+        return True, faces
+
+    def get(self, prop):
+        # the recorded capture time of the frame just read, like cv2.VideoCapture
+        if prop == cv2.CAP_PROP_POS_MSEC and self.index > 0:
+            return float(self.timestamps[self.index - 1]) * 1000.0
+        return 0.0
+
+    def findFaceLandmarks(self, faces, draw=True):
+        # nothing to draw on, the stream has no images
+        return None, faces
+
+    def detectPresence(self, faces, scale=0.25):
+        return len(faces) > 0
+
+    def rewind(self):
+        self.index = 0
+
+    def release(self):
+        pass
+
+
+class SessionRecorder:
+    """
+    Record a session as <prefix>.npz (landmarks of every frame) and,
+    if record_video is set, <prefix>.avi (raw camera frames).
+    """
+
+    def __init__(self, prefix, frame_size, max_num_faces=1, record_video=True, fps=30):
+        self.prefix = prefix
+        self.frame_size = frame_size
+        self.max_num_faces = max_num_faces
+
+        self.landmarks = []
+        self.num_faces = []
+        self.timestamps = []
+
+        self.writer = None
+        if record_video:
+            h, w = frame_size
+            self.writer = cv2.VideoWriter(prefix + '.avi', cv2.VideoWriter_fourcc(*'MJPG'), fps, (w, h))
+
+    def write_frame(self, img):
+        if self.writer is not None:
+            self.writer.write(img)
+
+    def write_landmarks(self, faces, timestamp=None):
+        frame = np.zeros((self.max_num_faces, NUM_LANDMARKS, 2), dtype=np.float32)
+        n = min(len(faces), self.max_num_faces)
+        frame[:n] = faces[:n]
+
+        self.landmarks.append(frame)
+        self.num_faces.append(n)
+        self.timestamps.append(time.monotonic() if timestamp is None else timestamp)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+        np.savez_compressed(
+            self.prefix + '.npz',
+            landmarks=np.array(self.landmarks, dtype=np.float32).reshape(-1, self.max_num_faces, NUM_LANDMARKS, 2),
+            num_faces=np.array(self.num_faces, dtype=np.int32),
+            timestamps=np.array(self.timestamps, dtype=np.float64),
+            frame_size=np.array(self.frame_size, dtype=np.int32))
@@ -0,0 +1,66 @@
+"""
+Decide which parameter frames are worth sending
+
+A frame is sent when one of its parameters moved more than the dead band of
+that parameter since the last frame sent for the same face, at most
+`max_rate` times per second, and at least every `keyframe_interval` seconds
+even if nothing moved, so late joining clients still get the pose.
+Without dead bands (empty `epsilons`) every frame counts as changed and
+only the rate cap applies.
+"""
+
+import time
+
+# dead band of every parameter, in the units of send_info_to_web
+DEFAULT_EPSILONS = {
+    'roll': 0.5, 'pitch': 0.5, 'yaw': 0.5,
+    'eyeLOpen': 0.05, 'eyeROpen': 0.05,
+    'mouthOpen': 0.02, 'mouthForm': 0.5,
+    'eyeBallX': 0.5, 'eyeBallY': 0.5,
+}
+
+
+class SendScheduler:
+    """Change-driven, rate-capped emission with periodic keyframes."""
+
+    def __init__(self, epsilons=None, max_rate=0.0, keyframe_interval=1.0, clock=time.monotonic):
+        self.epsilons = dict(DEFAULT_EPSILONS if epsilons is None else epsilons)
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.keyframe_interval = keyframe_interval
+        self.clock = clock
+
+        # face -> (time, parameters) of the last frame sent
+        self.last_sent = {}
+
+        self.sent = 0
+        self.suppressed = 0
+
+    def should_send(self, data, face=0):
+        """Return True if `data` has to be sent, and remember it if so"""
+        now = self.clock()
+        last = self.last_sent.get(face)
+
+        if last is None:
+            send = True
+        else:
+            last_time, last_data = last
+            elapsed = now - last_time
+
+            if elapsed < self.min_interval:
+                send = False
+            elif elapsed >= self.keyframe_interval:
+                send = True
+            elif not self.epsilons:
+                # no dead bands, only the rate cap
+                send = True
+            else:
+                send = any(abs(data[key] - last_data[key]) > eps
+                           for key, eps in self.epsilons.items() if key in data)
+
+        if send:
+            self.last_sent[face] = (now, dict(data))
+            self.sent += 1
+        else:
+            self.suppressed += 1
+
+        return send
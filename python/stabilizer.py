@@ -23,6 +23,10 @@ class Stabilizer:
         self.state_num = state_num
         self.measure_num = measure_num
 
+        # Time step of the transition matrix, in frames.
+        self.dt = 1.0
+        self.cov_process = cov_process
+
         # The filter itself.
         self.filter = cv2.KalmanFilter(state_num, measure_num, 0)
 
@@ -66,8 +70,28 @@ class Stabilizer:
             self.filter.measurementNoiseCov = np.array([[1, 0],
                                                         [0, 1]], np.float32) * cov_measure
 
-    def update(self, measurement):
-        """Update the filter"""
+    def set_dt(self, dt):
+        """
+        Rebuild the transition matrix and the process noise for a time step
+        of `dt` frames (1 is the constant step the filter was tuned for)
+        """
+        if dt == self.dt:
+            return
+
+        transition = self.filter.transitionMatrix.copy()
+        velocity = self.state_num // 2
+        for i in range(velocity):
+            transition[i, velocity + i] = dt
+        self.filter.transitionMatrix = transition
+
+        # the uncertainty of the motion grows with the elapsed time
+        self.filter.processNoiseCov = np.eye(self.state_num, dtype=np.float32) * self.cov_process * dt
+        self.dt = dt
+
+    def update(self, measurement, dt=1.0):
+        """Update the filter, `dt` frames after the previous update"""
+        self.set_dt(dt)
+
         # Make kalman prediction
         self.prediction = self.filter.predict()
 
@@ -86,20 +110,100 @@ class Stabilizer:
 
     def set_q_r(self, cov_process=0.1, cov_measure=0.001):
         """Set new value for processNoiseCov and measurementNoiseCov."""
+        self.cov_process = cov_process
         if self.measure_num == 1:
             self.filter.processNoiseCov = np.array([[1, 0],
-                                                    [0, 1]], np.float32) * cov_process
+                                                    [0, 1]], np.float32) * cov_process * self.dt
             self.filter.measurementNoiseCov = np.array(
                 [[1]], np.float32) * cov_measure
         else:
             self.filter.processNoiseCov = np.array([[1, 0, 0, 0],
                                                     [0, 1, 0, 0],
                                                     [0, 0, 1, 0],
-                                                    [0, 0, 0, 1]], np.float32) * cov_process
+                                                    [0, 0, 0, 1]], np.float32) * cov_process * self.dt
             self.filter.measurementNoiseCov = np.array([[1, 0],
                                                         [0, 1]], np.float32) * cov_measure
 
 
+class BatchStabilizer:
+    """
+    A bank of scalar Kalman filters (value, velocity) updated in one
+    vectorized step, equivalent to one scalar Stabilizer per channel.
+    cov_process and cov_measure are scalars or one value per channel.
+    The time step of every update is given in frames, the velocity is
+    per frame.
+    """
+
+    def __init__(self,
+                 channels,
+                 cov_process=0.1,
+                 cov_measure=0.1):
+        """Initialization"""
+        self.channels = channels
+
+        # Same model as the scalar Stabilizer.
+        self.transition = np.array([[1, 1],
+                                    [0, 1]], np.float32)
+
+        self.measurement_vector = np.array([1, 1], np.float32)
+
+        self.set_q_r(cov_process, cov_measure)
+        self.reset()
+
+    def reset(self):
+        """Clear the state and the error covariance of every channel"""
+        self.state = np.zeros((self.channels, 2), np.float32)
+        self.prediction = np.zeros((self.channels, 2), np.float32)
+        self.error_cov = np.zeros((self.channels, 2, 2), np.float32)
+
+    def set_q_r(self, cov_process=0.1, cov_measure=0.001):
+        """Set new (per-channel) values for processNoiseCov and measurementNoiseCov."""
+        cov_process = np.broadcast_to(np.asarray(cov_process, np.float32), (self.channels,))
+        cov_measure = np.broadcast_to(np.asarray(cov_measure, np.float32), (self.channels,))
+
+        self.process_noise = np.eye(2, dtype=np.float32)[None] * cov_process[:, None, None]
+        self.measurement_noise = cov_measure.copy()
+
+    def update(self, measurement, dt=1.0):
+        """
+        Update every filter with one measurement per channel, `dt` frames
+        after the previous update
+        """
+        A = self.transition
+        Q = self.process_noise
+        if dt != 1.0:
+            # x' = x + v dt, the uncertainty of the motion grows with dt
+            A = A.copy()
+            A[0, 1] = dt
+            Q = Q * np.float32(dt)
+        H = self.measurement_vector
+        z = np.asarray(measurement, np.float32).reshape(self.channels)
+
+        # Make kalman prediction
+        # x = A x, P = A P A^T + Q
+        self.prediction = self.state @ A.T
+        P = A @ self.error_cov @ A.T + Q
+
+        # Correct according to measurement
+        # K = P H^T / (H P H^T + R)
+        PHt = P @ H
+        S = PHt @ H + self.measurement_noise
+        K = PHt / S[:, None]
+
+        innovation = z - self.prediction @ H
+        self.state = self.prediction + K * innovation[:, None]
+
+        # P = P - K H P
+        self.error_cov = P - K[:, :, None] * (H @ P)[:, None, :]
+
+    def extrapolate(self, steps):
+        """
+        Value of every channel `steps` updates ahead, using the velocity of
+        the state (the transition matrix applied `steps` times)
+        """
+        return self.state[:, 0] + self.state[:, 1] * np.float32(steps)
+
+
 def main():
     """Test code"""
     global mp
@@ -0,0 +1,60 @@
+"""
+Behaviour of SendScheduler with a fake clock
+
+    python -m pytest test_send_scheduler.py
+"""
+
+from send_scheduler import SendScheduler
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def feed(scheduler, clock, frames, fps, value=lambda i: 0.0):
+    """Feed `frames` frames at `fps`, return the number of frames sent"""
+    sent = 0
+    for i in range(frames):
+        clock.now = i / fps
+        sent += scheduler.should_send({'yaw': value(i)})
+    return sent
+
+
+def test_rate_cap_alone():
+    # constant motion, 10 s at 30 fps, capped at 20 frames per second
+    clock = FakeClock()
+    scheduler = SendScheduler(epsilons={}, max_rate=20, clock=clock)
+    sent = feed(scheduler, clock, 300, 30, value=lambda i: float(i))
+    # every other frame of the 30 fps input passes the 50 ms interval
+    assert 140 <= sent <= 200
+
+
+def test_rate_cap_sends_still_frames():
+    # no dead bands: unchanged frames are only limited by the rate
+    clock = FakeClock()
+    scheduler = SendScheduler(epsilons={}, max_rate=12, clock=clock)
+    sent = feed(scheduler, clock, 300, 30)
+    assert 90 <= sent <= 110
+
+
+def test_dead_band_alone():
+    clock = FakeClock()
+    scheduler = SendScheduler(epsilons={'yaw': 0.5}, clock=clock)
+
+    # moves by 0.1 per frame, sent every time it drifted more than 0.5
+    sent = feed(scheduler, clock, 30, 30, value=lambda i: 0.1 * i)
+    assert 4 <= sent <= 6
+    assert scheduler.suppressed == 30 - sent
+
+
+def test_keyframes():
+    # nothing moves, only the first frame and the keyframes are sent
+    clock = FakeClock()
+    scheduler = SendScheduler(epsilons={'yaw': 0.5}, keyframe_interval=1.0, clock=clock)
+    sent = feed(scheduler, clock, 300, 30)
+    assert sent == 10
@@ -0,0 +1,308 @@
+"""
+Turn the facial landmarks of one face into the parameters of the avatar
+(pose estimation, facial features and stabilization)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# pose estimation and stablization
+from pose_estimator import PoseEstimator
+from stabilizer import BatchStabilizer
+
+# Miscellaneous detections (eyes/ mouth...)
+from facial_features import FeatureEngine, NUM_MESH_POINTS
+
+# timing spans
+from profiler import Profiler
+
+
+def threshold(v, L, H):
+    if L<=v and v<=H: return 0
+    if H<v : return 1
+    if v<L : return -1
+
+
+# shared, it has no per-face state
+feature_engine = FeatureEngine()
+
+# nominal time between two frames in seconds, the filters are tuned for it
+FRAME_PERIOD = 1 / 30
+
+# bounds of the time step of the filters, in frames
+MIN_DT = 0.1
+MAX_DT = 10.0
+
+
+class LatencyEstimator:
+    """
+    Running average of the capture-to-emit latency and of the time between
+    two frames, to know how many frames ahead the pose has to be predicted.
+    With `frame_period` set the lead is counted in frames of that length
+    (the filters run on capture timestamps), else in measured frames.
+    """
+
+    def __init__(self, smoothing=0.1, max_lead=3.0, frame_period=None):
+        self.smoothing = smoothing
+        self.max_lead = max_lead
+        self.frame_period = frame_period
+
+        self.latency = None
+        self.frame_interval = None
+        self._last_capture = None
+
+    def observe(self, t_capture, t_emit):
+        a = self.smoothing
+        latency = t_emit - t_capture
+        self.latency = latency if self.latency is None else (1 - a) * self.latency + a * latency
+
+        if self._last_capture is not None and t_capture > self._last_capture:
+            interval = t_capture - self._last_capture
+            self.frame_interval = interval if self.frame_interval is None else (1 - a) * self.frame_interval + a * interval
+        self._last_capture = t_capture
+
+    def lead_frames(self):
+        """Latency expressed in frames, clipped to max_lead"""
+        if self.latency is None:
+            return 0.0
+        interval = self.frame_period or self.frame_interval
+        if not interval:
+            return 0.0
+        return min(self.latency / interval, self.max_lead)
+
+
+class FaceTracker:
+    """Pose estimator and stabilizers of one tracked face."""
+
+    def __init__(self, img_size, profiler=None, frame_period=FRAME_PERIOD):
+        self.img_size = img_size
+        self.profiler = Profiler() if profiler is None else profiler
+        self.frame_period = frame_period
+
+        # Pose estimation related
+        self.pose_estimator = PoseEstimator(img_size)
+
+        # One bank of scalar stabilizers for every parameter:
+        # 6 for pose, 6 for eyes and 1 for mouth_dist
+        self.stabilizers = BatchStabilizer(
+            channels=13,
+            cov_process=0.1,
+            cov_measure=0.1)
+
+        # sequence number of the frames of this face
+        self.seq = 0
+
+        # capture time of the last update, for the time step of the filters
+        self.last_t = None
+
+        self.steady_pose = None
+        self.steady_pose_eye = None
+        self.steady_mouth_dist = None
+
+    def reset(self):
+        # reset our pose estimator
+        self.pose_estimator.reset()
+
+    def update(self, face, lead=0.0, t=None):
+        """
+        Return the avatar parameters computed from `face`, a (478, 2) array
+        of landmarks as returned by FaceMeshDetector.findFaceLandmarks.
+        The stabilized values are extrapolated `lead` frames ahead.
+        t is the capture time in seconds, without it every update counts
+        as one frame.
+        """
+        image_points = face[:NUM_MESH_POINTS]
+        dt = self.time_step(t)
+
+        profiler = self.profiler
+
+        with profiler.span('solve_pose_by_all_points'):
+            pose = self.solve_pose(image_points)
+
+        with profiler.span('features'):
+            features = self.extract_features(face)
+
+        with profiler.span('stabilizers'):
+            self.stabilize(pose, features, lead, dt)
+            data = self.avatar_params(features)
+
+        return data
+
+    def time_step(self, t):
+        """Frames elapsed since the last update (1 without timestamps)"""
+        last_t, self.last_t = self.last_t, t
+        if t is None or last_t is None:
+            return 1.0
+        return min(max((t - last_t) / self.frame_period, MIN_DT), MAX_DT)
+
+    def solve_pose(self, image_points):
+        # The third step: pose estimation
+        # pose: [[rvec], [tvec]]
+        return self.pose_estimator.solve_pose_by_all_points(image_points)
+
+    def extract_features(self, face):
+        """
+        Return [ear_left, ear_right, x_ratio_left, y_ratio_left,
+        x_ratio_right, y_ratio_right, mar, mouth_distance]
+        """
+        return feature_engine.compute(face)
+
+    def stabilize(self, pose, features, lead=0.0, dt=1.0):
+        """
+        Feed the filters, `dt` frames after the previous call. The results
+        are stored in self.steady_*, extrapolated `lead` frames ahead with
+        the velocity of the filters
+        """
+        measurement = np.empty(13, np.float32)
+        measurement[:6] = np.ravel(pose)
+        measurement[6:12] = features[:6]
+        measurement[12] = features[7]
+
+        self.stabilizers.update(measurement, dt)
+        if lead > 0:
+            steady = self.stabilizers.extrapolate(lead)
+        else:
+            steady = self.stabilizers.state[:, 0]
+
+        self.steady_pose = steady[:6].reshape(-1, 3).copy()
+        self.steady_pose_eye = steady[6:12].copy()
+        self.steady_mouth_dist = steady[12]
+
+    def avatar_params(self, features):
+        """Map the stabilized pose and the features to the Live2D parameters"""
+        ear_left, ear_right = features[0], features[1]
+        pose_eye = features[:6]
+        mar, mouth_distance = features[6], features[7]
+        steady_pose = self.steady_pose
+
+        # calculate the roll/ pitch/ yaw
+        # roll: +ve when the axis pointing upward
+        # pitch: +ve when we look upward
+        # yaw: +ve when we look left
+        if steady_pose[0][0] < 0 : steady_pose[0][0] = -steady_pose[0][0]
+
+        roll = np.clip(np.degrees(steady_pose[0][1]), -30, 30) * 2
+        pitch = np.clip(177 - abs(np.degrees(steady_pose[0][0])), -90, 90) * 3
+        yaw =  np.clip(np.degrees(steady_pose[0][2]), -30, 30) + 3
+
+        # eyeBallX = -(steady_pose_eye[2][0] + steady_pose_eye[4][0])/2
+        # eyeBallY = -(steady_pose_eye[3][0] + steady_pose_eye[5][0])/2
+        eyeBallX = -(pose_eye[2] + pose_eye[4])/2
+        eyeBallY = -(pose_eye[3] + pose_eye[5])/2
+
+        # plain Python numbers, the numpy (float32) ones are not JSON serializable
+        data = {
+            'roll': float(roll), 'pitch': float(pitch), 'yaw': float(yaw),
+            'eyeLOpen': float(ear_left*6 - 2),
+            'eyeROpen': float(ear_right*6 - 2),
+            'mouthOpen': float(mar*1.5),
+            'mouthForm': int(threshold(mouth_distance,45,50) - 1),
+            'eyeBallX': int(threshold(-eyeBallX,0.45,0.57)),
+            # 'eyeBallY': threshold(eyeBallY,-0.55,-0.35),
+            'eyeBallY': 0,
+            'seq': self.seq,
+        }
+        self.seq += 1
+        return data
+
+    def draw_axes(self, img):
+        """Draw the stabilized pose of the last update on `img`"""
+        if self.steady_pose is not None:
+            self.pose_estimator.draw_axes(img, self.steady_pose[0], self.steady_pose[1])
+
+
+class MultiFaceTracker:
+    """
+    One FaceTracker per detected face. Every face keeps its channel id across
+    frames (matched by the distance between the landmark centers), the ids
+    of faces lost for more than `max_missing` frames are reused.
+    """
+
+    def __init__(self, img_size, max_num_faces=1, profiler=None, max_missing=5, predict=False,
+                 frame_period=FRAME_PERIOD):
+        self.img_size = img_size
+        self.max_num_faces = max_num_faces
+        self.profiler = Profiler() if profiler is None else profiler
+        self.max_missing = max_missing
+        self.frame_period = frame_period
+
+        # capture-to-emit latency, to extrapolate the pose (None: off)
+        self.latency = LatencyEstimator(frame_period=frame_period) if predict else None
+
+        self.trackers = {}      # id -> FaceTracker
+        self.centers = {}       # id -> landmark center of the last frame
+        self.missing = {}       # id -> number of frames since last seen
+
+        # solvePnP and the filters release the GIL, so faces run in parallel
+        self.pool = ThreadPoolExecutor(max_num_faces) if max_num_faces > 1 else None
+
+    def assign(self, faces):
+        """Return the channel id of every face of `faces`, (n, 478, 2)"""
+        centers = faces.mean(axis=1)
+        sizes = (faces.max(axis=1) - faces.min(axis=1)).max(axis=1)
+
+        ids = [None] * len(faces)
+        known = list(self.centers.keys())
+
+        # greedy matching, closest pairs first
+        if known:
+            known_centers = np.array([self.centers[face_id] for face_id in known])
+            dist = np.linalg.norm(centers[:, None] - known_centers[None], axis=2)
+            used = set()
+            for flat in np.argsort(dist, axis=None):
+                i, j = np.unravel_index(flat, dist.shape)
+                if ids[i] is not None or j in used or dist[i, j] > sizes[i]:
+                    continue
+                ids[i] = known[j]
+                used.add(j)
+
+        for i in range(len(faces)):
+            if ids[i] is None:
+                # smallest free id
+                face_id = 0
+                while face_id in self.trackers or face_id in ids:
+                    face_id += 1
+                ids[i] = face_id
+                self.trackers[face_id] = FaceTracker(self.img_size, self.profiler, self.frame_period)
+
+            self.centers[ids[i]] = centers[i]
+            self.missing[ids[i]] = 0
+
+        return ids
+
+    def update(self, faces, lead=0.0, t=None):
+        """
+        Return a list of (id, avatar parameters) for every face of `faces`,
+        t is the capture time of the frame in seconds
+        """
+        ids = self.assign(faces) if len(faces) else []
+
+        self.drop_missing(ids)
+
+        if self.pool is None or len(ids) < 2:
+            results = [self.trackers[face_id].update(face, lead, t) for face_id, face in zip(ids, faces)]
+        else:
+            results = list(self.pool.map(lambda args: self.trackers[args[0]].update(args[1], lead, t), zip(ids, faces)))
+
+        return list(zip(ids, results))
+
+    def drop_missing(self, seen):
+        for face_id in list(self.trackers.keys()):
+            if face_id in seen:
+                continue
+
+            self.missing[face_id] += 1
+            if self.missing[face_id] == 1:
+                # reset our pose estimator
+                self.trackers[face_id].reset()
+            if self.missing[face_id] > self.max_missing:
+                del self.trackers[face_id], self.centers[face_id], self.missing[face_id]
+
+    def reset(self):
+        self.drop_missing([])
+
+    def poses(self):
+        """Copy of the stabilized pose of every face seen in the last frame"""
+        return [tracker.steady_pose.copy() for face_id, tracker in self.trackers.items()
+                if self.missing[face_id] == 0 and tracker.steady_pose is not None]
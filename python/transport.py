@@ -0,0 +1,124 @@
+"""
+Transports sending the avatar parameter frames to the web client
+"""
+
+import asyncio
+import threading
+
+import socketio
+
+from wire import FrameEncoder
+
+
+class SocketIOTransport:
+    """
+    socket.io client connected to the relay (`socket server.js`).
+    With binary=True the parameter dicts are sent as binary frames
+    (see wire.py) instead of JSON.
+    """
+
+    def __init__(self, url='http://localhost:5252/', binary=False):
+        self.client = socketio.Client()
+        self.client.connect(url)
+
+        self.encoder = FrameEncoder() if binary else None
+
+    def emit(self, event, data):
+        if self.encoder is not None and isinstance(data, dict):
+            data = self.encoder.encode(data)
+        self.client.emit(event, data)
+
+    def disconnect(self):
+        self.client.disconnect()
+
+
+class AsyncSocketIOTransport:
+    """
+    socket.io client running on its own asyncio event loop thread, so emit()
+    never blocks the tracking loop. Every (event, face) has a latest-value
+    mailbox: a frame still waiting when a newer one arrives is replaced
+    (coalesced). The client reconnects on its own, frames are kept in the
+    mailbox meanwhile.
+    """
+
+    def __init__(self, url='http://localhost:5252/', binary=False, retry_interval=1.0):
+        self.url = url
+        self.retry_interval = retry_interval
+        self.encoder = FrameEncoder() if binary else None
+
+        self._mailbox = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+
+        # counters
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self.loop.run_until_complete, args=(self._main(),), daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def emit(self, event, data):
+        key = (event, data.get('face') if isinstance(data, dict) else None)
+        if self.encoder is not None and isinstance(data, dict):
+            data = self.encoder.encode(data)
+
+        with self._lock:
+            if key in self._mailbox:
+                self.coalesced += 1
+            self._mailbox[key] = (event, data)
+
+        self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    def disconnect(self, timeout=2.0):
+        if not self._thread.is_alive():
+            return
+        # _main sends the frames left and closes the socket before it returns
+        self.loop.call_soon_threadsafe(self._shutdown)
+        self._thread.join(timeout)
+
+    async def _main(self):
+        self.client = socketio.AsyncClient(reconnection=True)
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+
+        connecting = asyncio.ensure_future(self._connect())
+
+        while not self._stopping:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            # keep the frames in the mailbox until we are (re)connected
+            while not self.client.connected and not self._stopping:
+                await asyncio.sleep(0.05)
+
+            with self._lock:
+                items = list(self._mailbox.values())
+                self._mailbox.clear()
+
+            for event, data in items:
+                try:
+                    await self.client.emit(event, data)
+                    self.sent += 1
+                except socketio.exceptions.SocketIOError:
+                    self.dropped += 1
+
+        connecting.cancel()
+        if self.client.connected:
+            await self.client.disconnect()
+
+    async def _connect(self):
+        # the client only reconnects by itself once it has been connected
+        while not self._stopping:
+            try:
+                await self.client.connect(self.url)
+                return
+            except socketio.exceptions.ConnectionError:
+                await asyncio.sleep(self.retry_interval)
+
+    def _shutdown(self):
+        self._stopping = True
+        self._wakeup.set()
@@ -0,0 +1,54 @@
+"""
+Compact binary format of the avatar parameter frames
+
+A frame is a little-endian header followed by one float32 per parameter:
+
+    uint8   version     WIRE_VERSION
+    uint8   count       number of parameters, len(PARAM_KEYS)
+    uint16  face        channel id of the face
+    uint32  seq         sequence number of the frame
+    float64 t           capture timestamp, monotonic clock in ms
+    float32 params[count]
+
+The matching decoder of the web client is Samples/TypeScript/Demo/src/lappwire.ts,
+both have to be changed together.
+"""
+
+import struct
+
+WIRE_VERSION = 2
+
+# order of the parameters in the frame
+PARAM_KEYS = ['roll', 'pitch', 'yaw',
+              'eyeLOpen', 'eyeROpen',
+              'mouthOpen', 'mouthForm',
+              'eyeBallX', 'eyeBallY']
+
+_frame = struct.Struct('<BBHId%df' % len(PARAM_KEYS))
+
+
+class FrameEncoder:
+    """Pack the parameter dicts of send_info_to_web into binary frames."""
+
+    def __init__(self):
+        self.seq = 0
+
+    def encode(self, data):
+        seq = data.get('seq', self.seq)
+        payload = _frame.pack(WIRE_VERSION, len(PARAM_KEYS), data.get('face', 0), seq & 0xFFFFFFFF,
+                              data.get('t', 0.0), *[data[key] for key in PARAM_KEYS])
+        self.seq = seq + 1
+        return payload
+
+
+def decode(payload):
+    """Inverse of FrameEncoder.encode, return the parameter dict"""
+    version, count, face, seq, t, *params = _frame.unpack(payload)
+    if version != WIRE_VERSION or count != len(PARAM_KEYS):
+        raise ValueError("unsupported frame (version %d, %d parameters)" % (version, count))
+
+    data = dict(zip(PARAM_KEYS, params))
+    data['face'] = face
+    data['seq'] = seq
+    data['t'] = t
+    return data
@@ -0,0 +1,98 @@
+"""
+Compare lic_engine with the lic package on the gradients of a texture,
+for speed and visual parity (both normalized to 0..255 like getLICTexture)
+
+    python benchmark_lic.py
+    python benchmark_lic.py --input ./input/Haru_01.png --crop 1024 --length 100
+    python benchmark_lic.py --scale 0.5 --threads 4 --output lic_compare.png
+
+lic.lic allocates two int64 arrays of H x W x length, keep --crop small.
+At --scale 1 the results only differ where float32 rounding changes the
+cell a streamline enters. The downsampled mode gives a similar texture, but
+not the same pixels.
+"""
+
+from argparse import ArgumentParser
+import time
+
+import cv2
+import numpy as np
+
+import lic
+import lic_engine
+
+
+def gradients(img):
+    """The vector field of getLICTexture"""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+    blur = cv2.GaussianBlur(gray, (3,3), 1.3, 1.3)
+    Gx = cv2.Sobel(blur, cv2.CV_64F, 1, 0)
+    Gy = cv2.Sobel(blur, cv2.CV_64F, 0, 1)
+    return Gx, -Gy
+
+
+def to_uint8(lic_result):
+    return cv2.normalize(lic_result, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+
+def timed(fn, repeat):
+    best, res = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return res, best
+
+
+def parity(ref, res):
+    """Mean absolute difference, PSNR and correlation of two uint8 images"""
+    diff = ref.astype(np.float32) - res.astype(np.float32)
+    mse = float(np.mean(diff ** 2))
+    return {
+        'mae': float(np.mean(np.abs(diff))),
+        'psnr': float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse),
+        'corr': float(np.corrcoef(ref.ravel(), res.ravel())[0, 1]),
+    }
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.add_argument("--input", "-i", type=str, default="./input/Haru_00.png")
+    parser.add_argument("--crop", type=int, default=512,
+                        help="side of the center crop of the texture, 0: whole texture")
+    parser.add_argument("--length", type=int, default=100,
+                        help="streamline length")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="downsample factor of lic_engine")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="threads of lic_engine (default: number of cores)")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", "-o", type=str, default=None,
+                        help="write both results side by side to this file")
+    args = parser.parse_args()
+
+    img = cv2.imread(args.input, cv2.IMREAD_UNCHANGED)
+    if args.crop:
+        h, w = img.shape[:2]
+        y, x = max((h - args.crop) // 2, 0), max((w - args.crop) // 2, 0)
+        img = img[y:y + args.crop, x:x + args.crop]
+
+    data_x, data_y = gradients(img)
+    seed = lic.gen_seed(data_x.shape)
+    print("%s: %dx%d, length %d" % (args.input, img.shape[1], img.shape[0], args.length))
+
+    ref, t_ref = timed(lambda: lic.lic(data_x, data_y, seed=seed, length=args.length), args.repeat)
+    res, t_res = timed(lambda: lic_engine.lic(data_x, data_y, seed=seed, length=args.length,
+                                              scale=args.scale, threads=args.threads), args.repeat)
+
+    ref, res = to_uint8(ref), to_uint8(res)
+    stats = parity(ref, res)
+
+    print("lic.lic     %8.3f s" % t_ref)
+    print("lic_engine  %8.3f s (%.1fx)" % (t_res, t_ref / t_res if t_res > 0 else 0))
+    print("parity: mae %.2f, psnr %.1f dB, correlation %.4f" % (stats['mae'], stats['psnr'], stats['corr']))
+
+    if args.output:
+        cv2.imwrite(args.output, np.hstack([ref, res]))
@@ -0,0 +1,61 @@
+"""
+Content-addressed cache of the stylized textures
+
+A texture is stored as <root>/<key>.png, the key is a hash of everything the
+result depends on: the bytes of the input image, the style, the effect
+parameters, the effect version (style_lib.EFFECT_VERSIONS) and the bytes of
+the extra files the effect reads (style_lib.EFFECT_ASSETS). Changing any of
+them gives a new key, so stale textures are rebuilt and the others are
+copied from the cache.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import cv2
+
+
+def file_digest(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class TextureCache:
+
+    def __init__(self, root="./.cache"):
+        self.root = root
+
+    def key(self, filename, style, params=None, version=0, assets=()):
+        description = {
+            "input": file_digest(filename),
+            "style": style,
+            "params": params or {},
+            "version": version,
+            "assets": [file_digest(asset) for asset in assets],
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key + ".png")
+
+    def fetch(self, key, output):
+        """Copy the cached texture to `output`, return False on a miss"""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return False
+        shutil.copyfile(path, output)
+        return True
+
+    def store(self, key, img):
+        os.makedirs(self.root, exist_ok=True)
+
+        # write to a temporary file first, parallel builds never see half a png
+        path = self.path(key)
+        tmp = "%s.%d.tmp.png" % (path, os.getpid())
+        cv2.imwrite(tmp, img)
+        os.replace(tmp, path)
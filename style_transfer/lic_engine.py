@@ -0,0 +1,150 @@
+"""
+Line integral convolution on float32 vector fields
+
+Same algorithm as lic.lic (the streamline of every pixel walks length / 2
+cells forward and backward through the field and the seed is averaged
+along it), but without
+the H x W x length index arrays: the seed is accumulated step by step, so
+the memory is a few float32 arrays per band of rows. The bands run on a
+thread pool, numpy releases the GIL during the array operations.
+
+Optionally the field is downsampled first and the result upsampled, the
+streamlines get shorter by the same factor. Tiled callers downsample the
+whole field once (downsample) and tile the small one: resizing every tile
+on its own would not match the resize of the whole field.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+EPS = 1e-6
+
+# default size of the thread pool, None: number of cores
+THREADS = None
+
+
+def gen_seed(shape):
+    """White noise seed, the same as lic.gen_seed generates"""
+    seed = np.random.RandomState(28032005).random_sample(shape)
+    seed[0, :] = seed[:, 0] = seed[-1, :] = seed[:, -1] = 0.5
+    return seed.astype(np.float32)
+
+
+def downsample(data_x, data_y, seed, length, scale):
+    """The field, seed and streamline length of lic(scale=scale)"""
+    h, w = data_x.shape
+    small = (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1))
+    data_x = cv2.resize(data_x, small, interpolation=cv2.INTER_AREA)
+    data_y = cv2.resize(data_y, small, interpolation=cv2.INTER_AREA)
+    # keep the contrast of the noise
+    seed = cv2.resize(seed, small, interpolation=cv2.INTER_NEAREST)
+    return data_x, data_y, seed, max(int(round(length * scale)), 1)
+
+
+def lic_band(data_x, data_y, seed, rows, length):
+    """
+    Mean of the seed along the `length` cells of the streamlines starting at
+    the pixels of `rows` (a slice), the streamlines cross the whole field
+    """
+    h, w = data_x.shape
+    flat_x, flat_y, flat_seed = data_x.ravel(), data_y.ravel(), seed.ravel()
+
+    # field at the start of the streamlines
+    start_x, start_y = data_x[rows], data_y[rows]
+    shape = start_x.shape
+
+    # cell of every streamline and position inside the cell
+    line_x = np.repeat(np.arange(h)[rows, None], w, axis=1)
+    line_y = np.repeat(np.arange(w)[None, :], shape[0], axis=0)
+    fx = np.full(shape, 0.5, np.float32)
+    fy = np.full(shape, 0.5, np.float32)
+    tx = np.full(shape, np.inf, np.float32)
+    ty = np.full(shape, np.inf, np.float32)
+
+    # time to leave the cell along x and y, only where the field moves
+    pos_x, neg_x = start_x > EPS, start_x < -EPS
+    pos_y, neg_y = start_y > EPS, start_y < -EPS
+    step_x = np.where(start_x > 0, 1, -1)
+    step_y = np.where(start_y > 0, 1, -1)
+
+    # position in the next cell
+    enter_x = np.where(start_x > 0, 0, 1).astype(np.float32)
+    enter_y = np.where(start_y > 0, 0, 1).astype(np.float32)
+
+    acc = seed[rows].astype(np.float32)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for _ in range(1, length):
+            np.copyto(tx, (1 - fx) / start_x, where=pos_x)
+            np.copyto(tx, -fx / start_x, where=neg_x)
+            np.copyto(ty, (1 - fy) / start_y, where=pos_y)
+            np.copyto(ty, -fy / start_y, where=neg_y)
+
+            move_x = tx < ty
+            move_y = ~move_x
+
+            line_x += np.where(move_x, step_x, 0)
+            line_y += np.where(move_y, step_y, 0)
+            np.clip(line_x, 0, h - 1, out=line_x)
+            np.clip(line_y, 0, w - 1, out=line_y)
+
+            # entering the next cell
+            np.copyto(fx, enter_x, where=move_x)
+            np.copyto(fy, enter_y, where=move_y)
+
+            index = line_x * w + line_y
+            fy += np.where(move_x, flat_y[index] * tx, 0)
+            fx += np.where(move_y, flat_x[index] * ty, 0)
+
+            acc += flat_seed[index]
+
+    return acc / length
+
+
+def lic(data_x, data_y, seed=None, length=20, scale=1.0, normalize=True, threads=None, band_rows=64):
+    """
+    Line integral convolution of the field (data_x, data_y), as lic.lic with
+    a box kernel: data_x moves along the rows, data_y along the columns.
+    The result is normalized to 0..1 unless normalize is False (e.g. for
+    tiles, which have to be normalized together).
+
+    scale < 1 computes it on a downsampled field (and seed) with streamlines
+    of length * scale, and upsamples the result.
+    threads: size of the thread pool (default: THREADS),
+    band_rows: rows per task.
+    """
+    data_x = np.asarray(data_x, np.float32)
+    data_y = np.asarray(data_y, np.float32)
+    size = data_x.shape
+    if seed is None:
+        seed = gen_seed(size)
+    seed = np.asarray(seed, np.float32)
+
+    if scale != 1.0:
+        data_x, data_y, seed, length = downsample(data_x, data_y, seed, length, scale)
+
+    h = data_x.shape[0]
+    bands = [slice(y, min(y + band_rows, h)) for y in range(0, h, band_rows)]
+
+    # half of the streamline along the field, half against it
+    backward = max(length // 2, 1)
+    halves = [(data_x, data_y, length - backward), (-data_x, -data_y, backward)]
+
+    res = np.zeros(data_x.shape, np.float32)
+    threads = threads or THREADS or os.cpu_count()
+    with ThreadPoolExecutor(threads) as pool:
+        tasks = [(field_x, field_y, steps, rows) for field_x, field_y, steps in halves for rows in bands]
+        results = pool.map(lambda task: lic_band(task[0], task[1], seed, task[3], task[2]), tasks)
+        for task, band in zip(tasks, results):
+            res[task[3]] += 0.5 * band
+
+    if normalize:
+        res -= res.min()
+        res /= max(res.max(), EPS)
+
+    if scale != 1.0:
+        res = cv2.resize(res, (size[1], size[0]), interpolation=cv2.INTER_LINEAR)
+
+    return res
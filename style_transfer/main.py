@@ -1,9 +1,15 @@
 
 
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import cv2
 import numpy as np
-from utils import separateEdge, combine
-from style_lib import happy_effect, angry_effect, suprise_effect, art_effect
+import lic_engine
+from utils import separateEdge, combine, TILE_SIZE
+from style_lib import happy_effect, angry_effect, suprise_effect, art_effect, EFFECT_VERSIONS, EFFECT_ASSETS
+from cache import TextureCache
 
 def apply_motion_blur(image, size, angle):
     k = np.zeros((size, size), dtype=np.float32)
@@ -27,76 +33,150 @@ def stylize(img, mode="oil_painting"):
     
     return res
 
-def main(filename, style, debug=False):
+def main(filename, style, debug=False, params=None, tile_size=None):
+    params = params or {}
 
     if style=="Surprise" or style=="Happy" or style=="Angry":
         img = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
 
-        if style=="Happy":          img_stylized = happy_effect(img)
-        elif style=="Angry":        img_stylized = angry_effect(img)
-        elif style=="Surprise":     img_stylized = suprise_effect(img)
+        if style=="Happy":          img_stylized = happy_effect(img, tile_size=tile_size, **params)
+        elif style=="Angry":        img_stylized = angry_effect(img, tile_size=tile_size, **params)
+        elif style=="Surprise":     img_stylized = suprise_effect(img, tile_size=tile_size, **params)
         
         # img_stylized = stylize(img, mode=style)
         img_stylized[:,:,3] = img[:,:,3]
     elif style=="CloseEyes":
 
         img = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
-        img_nonEdge, img_edge = separateEdge(img)
-        cv2.imwrite("./close_nonEdge.png", img_nonEdge)
-        cv2.imwrite("./close_Edge.png", img_edge)
-        stylized_nonEdge = art_effect(img_nonEdge)
+        img_nonEdge, img_edge = separateEdge(img, tile_size)
+        if debug:
+            cv2.imwrite("./close_nonEdge.png", img_nonEdge)
+            cv2.imwrite("./close_Edge.png", img_edge)
+        stylized_nonEdge = art_effect(img_nonEdge, tile_size=tile_size, **params)
         # stylized_nonEdge = stylize(img_nonEdge, mode=style)
         img_stylized = combine(img_edge, stylized_nonEdge)
         img_stylized[:,:,3] = img[:,:,3]
     
     return img_stylized
 
+
+# inputs and outputs of every style
+configs = {
+    "Happy":
+    {
+        "input": ["./input/Haru_00.png", "./input/Haru_01.png"], 
+        "output":["./texture_02.png", "./texture_03.png"],
+        "back_output":"./back1.png",
+        "params": {"level": 22},
+    },
+    "Angry":
+    {
+        "input": ["./input/Haru_00.png", "./input/Haru_01.png"], 
+        "output":["./texture_04.png", "./texture_05.png"],
+        "back_output":"./back2.png",
+        "params": {"temp": 3000},
+    },
+    "Surprise":
+    {
+        "input": ["./input/Haru_00.png", "./input/Haru_01.png"], 
+        "output":["./texture_06.png", "./texture_07.png"],
+        "back_output":"./back3.png",
+        "params": {"blend": 0.3},
+    },
+    "CloseEyes":
+    {
+        "input": ["./input/Haru_00.png", "./input/Haru_01.png"], 
+        "output":["./texture_08.png", "./texture_09.png"],
+        "back_output":"./back4.png",
+        "params": {"length": 100, "lic_scale": 1.0},
+    }
+}
+
+
+def build_jobs(styles):
+    """(style, input, output) of every texture of `styles`"""
+    return [(style, filename, configs[style]["output"][i])
+            for style in styles
+            for i, filename in enumerate(configs[style]["input"])]
+
+def init_worker():
+    # one process per core already, keep OpenCV and the LIC from oversubscribing
+    cv2.setNumThreads(1)
+    lic_engine.THREADS = 1
+
+def run_job(job, debug=False, cache=None, tile_size=None):
+    """Build one texture, return (job, seconds, cached)"""
+    style, filename, output = job
+    params = configs[style].get("params", {})
+    start = time.perf_counter()
+
+    key = None
+    if cache is not None:
+        key = cache.key(filename, style, params, EFFECT_VERSIONS.get(style, 0), EFFECT_ASSETS.get(style, ()))
+        if cache.fetch(key, output):
+            return job, time.perf_counter() - start, True
+
+    res = main(filename=filename, style=style, debug=debug, params=params, tile_size=tile_size)
+    cv2.imwrite(output, res)
+    if cache is not None:
+        cache.store(key, res)
+    return job, time.perf_counter() - start, False
+
+def report(done, total, job, seconds, cached):
+    style, filename, output = job
+    status = "cached" if cached else "%.1f s" % seconds
+    print("[%d/%d] %-9s %s -> %s (%s)" % (done, total, style, filename, output, status))
+
+def build_all(styles, workers=None, debug=False, cache=None, tile_size=None):
+    """Build every (style x input) texture on a process pool"""
+    jobs = build_jobs(styles)
+    workers = workers or os.cpu_count()
+    print("building %d textures with %d processes" % (len(jobs), workers))
+
+    start = time.perf_counter()
+    busy = 0.0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        futures = [pool.submit(run_job, job, debug, cache, tile_size) for job in jobs]
+        hits = 0
+        for done, future in enumerate(as_completed(futures), 1):
+            job, seconds, cached = future.result()
+            busy += seconds
+            hits += cached
+            report(done, len(jobs), job, seconds, cached)
+
+    wall = time.perf_counter() - start
+    print("done in %.1f s wall-clock, %.1f s of work (%.1fx), %d of %d textures from the cache"
+          % (wall, busy, busy / wall if wall > 0 else 0, hits, len(jobs)))
+
 if __name__ == "__main__":
 
     import argparse
-    configs = {
-        "Happy":
-        {
-            "input": ["./input/Haru_00.png", "./input/Haru_01.png"], 
-            "output":["./texture_02.png", "./texture_03.png"],
-            "back_output":"./back1.png",
-        },
-        "Angry":
-        {
-            "input": ["./input/Haru_00.png", "./input/Haru_01.png"], 
-            "output":["./texture_04.png", "./texture_05.png"],
-            "back_output":"./back2.png",
-        },
-        "Surprise":
-        {
-            "input": ["./input/Haru_00.png", "./input/Haru_01.png"], 
-            "output":["./texture_06.png", "./texture_07.png"],
-            "back_output":"./back3.png",
-        },
-        "CloseEyes":
-        {
-            "input": ["./input/Haru_00.png", "./input/Haru_01.png"], 
-            "output":["./texture_08.png", "./texture_09.png"],
-            "back_output":"./back4.png",
-        }
-    }
     # python main.py -i ./input/Haru_01.png -o ./texture01.png -ei 3 -ep -1 -s oil_painting
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('--style', '-s', type=str, default="close", help='')
     parser.add_argument('--debug', '-d', type=bool, default=False, help='')
+    parser.add_argument('--all', '-a', action='store_true',
+                        help='build the textures of every style in parallel')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='number of processes of --all (default: number of cores)')
+    parser.add_argument('--cache-dir', type=str, default="./.cache",
+                        help='where the stylized textures are cached')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='rebuild every texture, ignoring the cache')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE,
+                        help='process the textures in tiles of this size to bound the memory, 0: whole image')
     args = parser.parse_args()
 
+    cache = None if args.no_cache else TextureCache(args.cache_dir)
 
-    
-    config = configs[args.style]
+    if args.all:
+        build_all(list(configs.keys()), args.jobs, args.debug, cache, args.tile_size)
+        raise SystemExit
 
-    for i, filename in enumerate(config["input"]):
+    jobs = build_jobs([args.style])
 
-        res = main( filename=filename, \
-                    style=args.style,
-                    debug=args.debug
-                    )
-        cv2.imwrite(config["output"][i], res)
+    for i, job in enumerate(jobs):
+        report(i + 1, len(jobs), *run_job(job, args.debug, cache, args.tile_size))
 
     back_img = cv2.imread("./input/back0.png")
 
@@ -1,27 +1,57 @@
 
+from functools import lru_cache
+
 from PIL import Image
 import cv2
-import lic
 import numpy as np
+import lic_engine
 # from pointillism import *
-from utils import rgba2rgb
+from utils import rgba2rgb, process_tiled
+
+# Bump the version of an effect whenever its code changes,
+# the cached textures of that style are rebuilt (see cache.py).
+EFFECT_VERSIONS = {
+    "Happy": 2,
+    "Angry": 1,
+    "Surprise": 1,
+    "CloseEyes": 4,
+}
 
-def getLICTexture(img):
+# Files read by the effects besides their input image.
+EFFECT_ASSETS = {
+    "Surprise": ["./input/cracked.jpg"],
+}
 
+def getLICTexture(img, length=100, tile_size=None, scale=1.0):
 
+    # the field and the noise of the whole image, downsampled once (a resize
+    # per tile would not match), then the streamlines are traced per tile
     gray = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
     blur = cv2.GaussianBlur(gray, (3,3), 1.3, 1.3)
-    Gx = cv2.Sobel(blur, cv2.CV_64F, 1, 0)
-    Gy = cv2.Sobel(blur, cv2.CV_64F, 0, 1)
-
-
-    print(Gx.shape, Gy.shape)
-    lic_result = lic.lic(Gx, -Gy, length=100)
+    Gx = cv2.Sobel(blur, cv2.CV_32F, 1, 0)
+    Gy = cv2.Sobel(blur, cv2.CV_32F, 0, 1)
+    seed = lic_engine.gen_seed(img.shape[:2])
+
+    data_x, data_y = Gx, -Gy
+    if scale != 1.0:
+        data_x, data_y, seed, length = lic_engine.downsample(data_x, data_y, seed, length, scale)
+    field = np.dstack([data_x, data_y, seed])
+
+    def lic_tile(crop, origin):
+        # not normalized per tile, the min and max of every tile differ
+        data_x, data_y, tile_seed = (np.ascontiguousarray(crop[:,:,i]) for i in range(3))
+        return lic_engine.lic(data_x, data_y, seed=tile_seed, length=length, normalize=False)
+
+    # the streamlines reach length / 2 pixels each way
+    lic_result = process_tiled(lic_tile, field, (length + 1) // 2, tile_size)
+    if scale != 1.0:
+        lic_result = cv2.resize(lic_result, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_LINEAR)
     print(np.max(lic_result), np.min(lic_result))
 
     # plt.imshow(lic_result, origin='lower', cmap='gray')
     # plt.show()
 
+    # normalized once for the whole image
     lic_result = cv2.normalize(lic_result, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
 
     return lic_result
@@ -50,25 +80,32 @@ kelvin_table = {
 }
 
 
+@lru_cache(maxsize=None)
+def temp_lut(temp):
+    """
+    (1, 256, 3) table scaling the channels by the colour of `temp` kelvin,
+    rounded like PIL's convert('RGB', matrix)
+    """
+    r, g, b = kelvin_table[temp]
+    scale = np.array([b, g, r], np.float32) / np.float32(255.0)
+    v = np.arange(256, dtype=np.float32)[:, None] * scale + np.float32(0.5)
+    return np.clip(v.astype(np.int32), 0, 255).astype(np.uint8)[None]
+
 def convert_temp(img, temp):
 
-    res = Image.fromarray(img)
-    print(res.mode)
-    r, g, b = kelvin_table[temp]
-    matrix = ( r / 255.0, 0.0, 0.0, 0.0,
-               0.0, g / 255.0, 0.0, 0.0,
-               0.0, 0.0, b / 255.0, 0.0 )
-    res = cv2.cvtColor(np.array(res.convert('RGB', matrix)), cv2.COLOR_RGB2BGR)
-    return res
+    # The matrix used to be applied by PIL on the BGR image taken as RGB and
+    # the result converted RGB2BGR: swap first, then scale by (b, g, r).
+    return cv2.LUT(cv2.cvtColor(img, cv2.COLOR_RGB2BGR), temp_lut(temp))
 
 
 
 
 
-def happy_effect(img):
+def happy_effect(img, level=22, tile_size=None):
 
+    # Canny on the whole image like separateEdge, only the bilateral filter is tiled
     res = img.copy()
-    gray = cv2.cvtColor(rgba2rgb(res), cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(rgba2rgb(res, tile_size=tile_size), cv2.COLOR_BGR2GRAY)
     canny = cv2.Canny(gray, 90, 128)
     canny = cv2.dilate(canny, kernel=np.ones((3,3), dtype=np.uint8), iterations=1).astype(np.bool8)
 
@@ -78,8 +115,9 @@ def happy_effect(img):
 
 
 
-    level = 22
-    res[:,:,:3] = cv2.bilateralFilter(res[:,:,:3], level, level*2, level/2)
+    # halo: radius of the bilateral filter of diameter `level`
+    res[:,:,:3] = process_tiled(lambda crop, origin: cv2.bilateralFilter(np.ascontiguousarray(crop), level, level*2, level/2),
+                                res[:,:,:3], level // 2 + 1, tile_size)
 
     res[:, :, 0][black_edge==255] = 0
     res[:, :, 1][black_edge==255] = 0
@@ -88,50 +126,72 @@ def happy_effect(img):
 
     return res
 
-def angry_effect(img):
-
+@lru_cache(maxsize=None)
+def angry_lut(temp, channels):
+    """
+    Table of the blue pixels of angry_effect, applied on (r, g, b', ...):
+    convert_temp, then 20 less blue and green, the other channels unchanged
+    """
+    lut = np.repeat(np.arange(256, dtype=np.int16)[None, :, None], channels, axis=2)
+    lut[:, :, :3] = temp_lut(temp)
+    lut[:, :, :2] -= 20
+    return np.clip(lut, 0, 255).astype(np.uint8)
 
+def angry_effect(img, temp=3000, tile_size=None):
 
-    b = img[:,:,0].astype(np.int16)
-    g = img[:,:,1].astype(np.int16)
-    r = img[:,:,2].astype(np.int16)
+    if tile_size:
+        # per pixel, no halo
+        return process_tiled(lambda crop, origin: angry_effect(crop, temp), img, 0, tile_size)
 
-    gray = cv2.cvtColor(img[:,:,:3].copy(), cv2.COLOR_BGR2GRAY)
-    
-    
-    mask_gray = (20<=gray) & (gray<=200) & \
-        (np.abs(b - g)<50) & (np.abs(b - r)<50) & (np.abs(g - r)<50)
+    channels = cv2.split(img)
+    b, g, r = channels[:3]
+    diff = np.empty_like(b)
 
+    # gray pixels: 20 <= gray <= 200 and channels close to each other
+    gray = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    mask_gray = cv2.inRange(gray, 20, 200)
+    for x, y in ((b, g), (b, r), (g, r)):
+        cv2.absdiff(x, y, dst=diff)
+        cv2.bitwise_and(mask_gray, cv2.threshold(diff, 49, 255, cv2.THRESH_BINARY_INV)[1], dst=mask_gray)
 
+    # turn them blue (saturating add, in place on the split channel)
+    cv2.add(b, 150, dst=b, mask=mask_gray)
 
+    # blue pixels: b - g > 20 and b - r > 20 (saturating subtract)
+    mask_blue = cv2.threshold(cv2.subtract(b, g, dst=diff), 20, 255, cv2.THRESH_BINARY)[1]
+    cv2.bitwise_and(mask_blue, cv2.threshold(cv2.subtract(b, r, dst=diff), 20, 255, cv2.THRESH_BINARY)[1], dst=mask_blue)
 
-    blue_img = img.copy()
-    blue_img[:,:,0][mask_gray] = np.clip(blue_img[:,:,0][mask_gray].astype(np.int16) + 150, 0, 255)
-    
-
-    
-
-    b = blue_img[:,:,0].astype(np.int16)
-    g = blue_img[:,:,1].astype(np.int16)
-    r = blue_img[:,:,2].astype(np.int16)
-    mask_blue = (b - g > 20) & (b - r > 20)
-    
-    red_img = convert_temp(blue_img[:,:,:3], 3000)
-
+    # the blue pixels get warm: one table lookup, copied into the result
+    red = cv2.LUT(cv2.merge([r, g, b, *channels[3:]]), angry_lut(temp, img.shape[2]))
 
     res = img.copy()
-    res[:,:,:3][mask_blue] = red_img[:,:,:3][mask_blue]
-    res[:,:,0][mask_blue] = np.clip(res[:,:,0][mask_blue].astype(np.int16) - 20, 0, 255)
-    res[:,:,1][mask_blue] = np.clip(res[:,:,1][mask_blue].astype(np.int16) - 20, 0, 255)
+    cv2.copyTo(red, mask_blue, res)
 
+    return res
 
+@lru_cache(maxsize=None)
+def load_crack_texture(mode):
+    texture = Image.open("./input/cracked.jpg").convert(mode)
+    texture = np.array(texture)
+    return cv2.resize(texture, (0, 0), fx=3, fy=3)
 
-    
+def crack_texture(mode, origin, shape):
+    """Crop of the crack texture tiled over the image, 3 times enlarged"""
+    texture = load_crack_texture(mode)
 
-    return res
+    # tile it, starting at `origin` of the whole image
+    h, w = texture.shape[:2]
+    rows = (origin[0] + np.arange(shape[0])) % h
+    cols = (origin[1] + np.arange(shape[1])) % w
+    return texture[rows[:, None], cols[None, :]]
 
-def suprise_effect(img):
+def suprise_effect(img, blend=0.3, tile_size=None, origin=(0, 0)):
     # print(img.shape)
+
+    if tile_size:
+        # halo: the two 3x3 erosions of the alpha edge
+        return process_tiled(lambda crop, origin: suprise_effect(crop, blend, origin=origin), img, 4, tile_size)
+
     res = img.copy()
 
     # Turn the image into (128, 132, 135)
@@ -161,23 +221,19 @@ def suprise_effect(img):
     res = Image.fromarray(res)
     
     # Load and tile the crack texture.
-    texture = Image.open("./input/cracked.jpg").convert(res.mode)
-    texture = np.array(texture)
-    texture = cv2.resize(texture, (0, 0), fx=3, fy=3)
-    texture = np.tile(texture, (2, 2, 1))
-    texture = Image.fromarray(texture[:img.shape[0], :img.shape[1]])
+    texture = Image.fromarray(crack_texture(res.mode, origin, img.shape[:2]))
     
     # Blend the result with crack texture.
-    res = Image.blend(res, texture, 0.3)
+    res = Image.blend(res, texture, blend)
     res = np.array(res)
     
     return res
 
 
-def art_effect(img):
+def art_effect(img, length=100, tile_size=None, lic_scale=1.0):
     print(img.shape)
     alpha = img[:,:,3]
-    texture = getLICTexture(img)
+    texture = getLICTexture(img, length, tile_size, lic_scale)
 
     # texture = cv2.imread("./input/back_texture.png", cv2.IMREAD_GRAYSCALE)
     
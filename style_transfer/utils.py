@@ -2,20 +2,54 @@ import cv2
 import numpy as np
 
 
+# side of the tiles of the tiled processing, in pixels
+TILE_SIZE = 512
+
+
+def process_tiled(fn, img, halo, tile_size=TILE_SIZE):
+    """
+    Apply fn(crop, origin) tile by tile and stitch the results.
+
+    Every crop is a tile extended by `halo` pixels on each side (clipped at
+    the image borders), origin is the (y, x) of its top-left corner in img.
+    The halo has to cover the support of the filters of fn, then only the
+    inside of every tile is kept and the result matches the full-frame one
+    while the temporaries of fn stay tile-sized.
+    """
+    h, w = img.shape[:2]
+    if not tile_size or (h <= tile_size and w <= tile_size):
+        return fn(img, (0, 0))
+
+    res = None
+    for y in range(0, h, tile_size):
+        for x in range(0, w, tile_size):
+            y0, x0 = max(y - halo, 0), max(x - halo, 0)
+            y1, x1 = min(y + tile_size + halo, h), min(x + tile_size + halo, w)
+            tile = fn(img[y0:y1, x0:x1], (y0, x0))
+
+            if res is None:
+                res = np.empty((h, w) + tile.shape[2:], dtype=tile.dtype)
+
+            th, tw = min(tile_size, h - y), min(tile_size, w - x)
+            res[y:y + th, x:x + tw] = tile[y - y0:y - y0 + th, x - x0:x - x0 + tw]
+
+    return res
+
 
 # return erode image and its edge
-def separateEdge(img_rgba):
+def separateEdge(img_rgba, tile_size=None):
 
-    gray = cv2.cvtColor(rgba2rgb(img_rgba), cv2.COLOR_BGR2GRAY)
+    # Canny runs on the whole image: its hysteresis follows weak edges over
+    # any distance, tiles would not match. Only the blending is tiled.
+    gray = cv2.cvtColor(rgba2rgb(img_rgba, tile_size=tile_size), cv2.COLOR_BGR2GRAY)
     canny = cv2.Canny(gray, 30, 100)
     canny = cv2.dilate(canny, kernel=np.ones((3,3), dtype=np.uint8), iterations=1)
 
     img_edge = img_rgba.copy()
     img_edge[:,:,3] = canny
 
-    img_erode =  img_rgba.copy()
-    img_erode = img_erode.astype(np.int16) - transparent2color(img_edge, (0,0,0)).astype(np.int16)
-    img_erode = np.clip(img_erode, 0, 255).astype(np.uint8)
+    # saturating uint8 subtract, no int16 copies
+    img_erode = cv2.subtract(img_rgba, transparent2color(img_edge, (0,0,0)))
 
     return img_erode, img_edge
     
@@ -38,12 +72,16 @@ def transparent2color(img_rgba, color=(255, 255, 255)):
     return res
 
 
-def rgba2rgb( rgba, background=(255,255,255) ):
+def rgba2rgb( rgba, background=(255,255,255), tile_size=None ):
     h, w, channel = rgba.shape
 
     if channel == 3:
         return rgba
 
+    if tile_size:
+        # per pixel, no halo
+        return process_tiled(lambda crop, origin: rgba2rgb(crop, background), rgba, 0, tile_size)
+
     assert channel == 4, 'RGBA image has 4 channels.'
 
     rgb = np.zeros( (h, w, 3), dtype=np.float32)